@@ -2,6 +2,7 @@
 客户端模块
 """
 
-from .deepseek_client import DeepSeekClient
+from .deepseek_client import DeepSeekClient, create_http_session
+from .rate_limiter import TokenBucket
 
-__all__ = ['DeepSeekClient']
+__all__ = ['DeepSeekClient', 'create_http_session', 'TokenBucket']
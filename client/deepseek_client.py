@@ -4,11 +4,20 @@ DeepSeek API客户端
 """
 
 import os
+import functools
 import json
 import re
+import threading
 import time
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时回退到标准库json
+    orjson = None
 
 import sys
 from pathlib import Path
@@ -51,6 +60,93 @@ MODEL_NAME = os.getenv("DEEPSEEK_MODEL", "deepseek-reasoner")  # 可通过环境
 # 生成参数（与网页版保持一致）
 TEMPERATURE = 0.7  # 控制随机性，0.7是网页版常用值
 
+# 中文字符匹配（用于token估算，模块加载时编译一次）
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+# 响应中usage信息的匹配（直接在原始字节上搜索，避免解码整个响应）
+_USAGE_RE = re.compile(rb'"usage"\s*:\s*\{[^}]+\}')
+
+# HTTP连接池配置（复用TCP/TLS连接，避免每次请求重新握手）
+HTTP_POOL_CONNECTIONS = 4  # 缓存的连接池数量（按host区分）
+HTTP_POOL_MAXSIZE = 16  # 每个连接池保留的最大连接数
+HTTP_MAX_RETRIES = 3  # 连接失败及限流/服务端错误状态码的自动重试次数
+HTTP_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# 每条数据实际输出token数的观测值：{轮次: EWMA}，所有client实例共享
+# 观测值按"响应内容token数/提取到的数据条数"计算（不含推理token），更新时加锁
+_OBSERVED_TOKENS_PER_ITEM: Dict[int, float] = {}
+_OBSERVED_TOKENS_LOCK = threading.Lock()
+OBSERVED_TOKENS_MARGIN = 1.1  # 使用观测值估算时额外增加的比例
+
+# 短于该长度的文本会缓存token估算结果（补齐指令等短文本会被反复估算）
+TOKEN_ESTIMATE_CACHE_MAX_LEN = 1024
+
+
+def _estimate_text_tokens(text: str) -> int:
+    """粗略估算token数量（中文约1.5字符/token，英文约4字符/token）"""
+    if not text:
+        return 0
+    # 纯ASCII文本没有中文字符，无需正则扫描
+    if text.isascii():
+        return len(text) >> 2
+    chinese_chars = len(_CJK_RE.findall(text))
+    other_chars = len(text) - chinese_chars
+    return int(chinese_chars / 1.5 + other_chars / 4)
+
+
+_estimate_short_text_tokens = functools.lru_cache(maxsize=4096)(_estimate_text_tokens)
+
+
+def _json_dumps(obj) -> bytes:
+    """序列化请求体为UTF-8字节（优先使用orjson）"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+@functools.lru_cache(maxsize=1)
+def _load_initial_prompt() -> str:
+    """读取initial prompt文件（每个进程只读取一次）"""
+    return config.INITIAL_PROMPT_FILE.read_text(encoding='utf-8')
+
+
+@functools.lru_cache(maxsize=4)
+def _build_system_message(initial_prompt: str) -> Tuple[Dict, int]:
+    """构建system message并估算其token数
+    
+    同一个prompt在进程内只构建、扫描一次，所有client实例和每次重置会话都共享同一个dict。
+    该dict会被多个会话的messages引用，不能修改。
+    """
+    return {"role": "system", "content": initial_prompt}, _estimate_text_tokens(initial_prompt)
+
+
+def create_http_session(pool_maxsize: int = HTTP_POOL_MAXSIZE) -> requests.Session:
+    """创建带连接池和自动重试的HTTP会话
+    
+    读取超时不重试：此时服务端可能已经在生成内容，重试会重复计费，
+    交给调用方的重试逻辑处理。read=False 使urllib3直接抛出原始的读取超时，
+    requests将其转换为 ReadTimeout（而不是包装成 ConnectionError），由超时分支处理。
+    
+    并发模式下由主程序创建一个会话注入所有client共享，pool_maxsize应不小于并发worker数量，
+    否则超出连接池的连接用完即关闭，无法复用。
+    """
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        read=False,
+        backoff_factor=0.5,
+        status_forcelist=HTTP_RETRY_STATUS,
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False  # 重试用尽后返回最后的响应，由raise_for_status统一处理
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 
 class DeepSeekClient:
     """DeepSeek API客户端
@@ -61,19 +157,48 @@ class DeepSeekClient:
     3. 智能管理会话长度，在接近限制时开启新会话
     """
     
-    def __init__(self, api_key: str, model: str = None):
+    def __init__(self, api_key: str, model: str = None, session: Optional[requests.Session] = None):
         self.api_key = api_key
         self.model = model or MODEL_NAME
         self.session_messages: List[Dict] = []
         self.system_prompt: Optional[str] = None  # 固定的system prompt，用于缓存
         self.current_tokens = 0
         self.initial_prompt_tokens = 0  # initial prompt的token数，用于估算
+        # 请求头和HTTP会话只创建一次，后续请求复用连接
+        self._headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+        # 传入session时与其他client共享连接池（会话状态仍然各自独立），否则单独创建
+        self._session = session if session is not None else create_http_session()
+        # 请求数据中不随调用变化的部分只构建一次，符合DeepSeek API规范
+        self._base_payload = {
+            "model": self.model,
+            "temperature": TEMPERATURE,
+            "stream": False,  # 不使用流式输出
+        }
+        # 如果使用reasoner模型，启用思考模式以保证生成质量
+        # 思考模式会让模型进行推理思考，生成质量更高，但速度稍慢
+        if "reasoner" in self.model.lower():
+            self._base_payload["thinking"] = {
+                "type": "enabled"  # 启用思考模式，保证生成质量
+            }
+        # 默认使用JSON模式，可以确保输出是有效的JSON格式（_send_request可按需关闭）
+        # 注意：使用JSON模式时，prompt中必须明确要求生成JSON
+        self._base_payload["response_format"] = {
+            "type": "json_object"
+        }
+        # 最近一次预检查估算过的(消息, token数)，send_message发送同一条消息时直接复用
+        self._last_estimate: Optional[Tuple[str, int]] = None
+        # 最近一次响应的内容token数（不含推理token），用于更新每条数据token数的观测值
+        self._last_content_tokens = 0
         
     def _estimate_tokens(self, text: str) -> int:
         """粗略估算token数量（中文约1.5字符/token，英文约4字符/token）"""
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text))
-        other_chars = len(text) - chinese_chars
-        return int(chinese_chars / 1.5 + other_chars / 4)
+        if len(text) < TOKEN_ESTIMATE_CACHE_MAX_LEN:
+            return _estimate_short_text_tokens(text)
+        return _estimate_text_tokens(text)
     
     def _check_if_need_new_session(self, message: str, estimated_output_tokens: int) -> bool:
         """检查发送指定消息是否需要开启新会话
@@ -85,8 +210,9 @@ class DeepSeekClient:
         Returns:
             True表示需要开启新会话，False表示不需要
         """
-        # 估算消息的token数
+        # 估算消息的token数（记录下来，随后send_message发送同一条消息时不再重复估算）
         message_tokens = self._estimate_tokens(message)
+        self._last_estimate = (message, message_tokens)
         
         # 计算发送后预期的总token数
         expected_total = self.current_tokens + message_tokens + estimated_output_tokens
@@ -94,6 +220,35 @@ class DeepSeekClient:
         # 如果超过限制，需要开启新会话
         return expected_total >= MAX_CONTEXT_LENGTH
     
+    def tokens_per_item(self, round_num: int) -> float:
+        """每条数据的预估token数
+        
+        配置中的静态值作为下限；已有实际观测值时，取观测值（加10%余量）和静态值中的较大者。
+        """
+        static_tokens = config.TOKENS_PER_ITEM_BY_ROUND.get(round_num, 1000)
+        observed = _OBSERVED_TOKENS_PER_ITEM.get(round_num)
+        if observed is None:
+            return static_tokens
+        return max(static_tokens, observed * OBSERVED_TOKENS_MARGIN)
+    
+    def record_output_items(self, round_num: int, item_count: int) -> None:
+        """根据最近一次响应的内容token数和提取到的数据条数，更新该轮次每条数据token数的EWMA
+        
+        Args:
+            round_num: 对话轮次（1-5）
+            item_count: 从最近一次响应中提取到的数据条数
+        """
+        if item_count <= 0 or self._last_content_tokens <= 0:
+            return
+        sample = self._last_content_tokens / item_count
+        alpha = config.TOKENS_PER_ITEM_EWMA_ALPHA
+        with _OBSERVED_TOKENS_LOCK:
+            previous = _OBSERVED_TOKENS_PER_ITEM.get(round_num)
+            if previous is None:
+                _OBSERVED_TOKENS_PER_ITEM[round_num] = sample
+            else:
+                _OBSERVED_TOKENS_PER_ITEM[round_num] = previous + alpha * (sample - previous)
+    
     def estimate_output_tokens(self, round_num: int, needed_count: int) -> int:
         """根据轮次和需要的数据量，估算输出token数（保守估算，加buffer）
         
@@ -104,6 +259,7 @@ class DeepSeekClient:
         - 超出50条都按30%计算
         
         对于reasoner模型，额外增加固定的推理token常数。
+        每条数据的token数见 tokens_per_item（静态配置为下限，随实际输出自适应调整）。
         
         Args:
             round_num: 对话轮次（1-5）
@@ -113,7 +269,7 @@ class DeepSeekClient:
             预估的输出token数（保守估算，已加buffer）
         """
         # 估算每条数据的token数
-        tokens_per_item = config.TOKENS_PER_ITEM_BY_ROUND.get(round_num, 1000)
+        tokens_per_item = self.tokens_per_item(round_num)
         
         # 计算buffer比例（反比例关系）
         # 当needed_count = 1时，buffer = 50% (最高，即1.5倍)
@@ -141,12 +297,10 @@ class DeepSeekClient:
         根据DeepSeek API的多轮对话规范，直接将system prompt放入messages中。
         后续的user message和assistant response会追加到messages数组中。
         """
-        self.session_messages = [{
-            "role": "system",
-            "content": initial_prompt
-        }]
+        # system message和token数按prompt缓存，重置会话时直接复用，不再重新构建和扫描
+        system_message, self.initial_prompt_tokens = _build_system_message(initial_prompt)
+        self.session_messages = [system_message]
         self.system_prompt = initial_prompt
-        self.initial_prompt_tokens = self._estimate_tokens(initial_prompt)
         self.current_tokens = self.initial_prompt_tokens
         print(f"✅ 新会话已开启 (system prompt: {self.initial_prompt_tokens} tokens)")
     
@@ -168,7 +322,11 @@ class DeepSeekClient:
             "content": message
         })
         
-        message_tokens = self._estimate_tokens(message)
+        if self._last_estimate is not None and self._last_estimate[0] is message:
+            message_tokens = self._last_estimate[1]
+        else:
+            message_tokens = self._estimate_tokens(message)
+        self._last_estimate = None
         self.current_tokens += message_tokens
         
         # 发送请求
@@ -204,13 +362,10 @@ class DeepSeekClient:
         """
         if self._check_if_need_new_session(message, estimated_output_tokens):
             print(f"⚠️  检测到token不足 ({self.current_tokens} tokens)，开启新会话...")
-            # 使用传入的initial_prompt（避免重复读取文件）
-            # 如果self.system_prompt存在，说明之前已经读取过，可以直接使用
-            if self.system_prompt:
-                initial_prompt = self.system_prompt
-            else:
-                initial_prompt = config.INITIAL_PROMPT_FILE.read_text(encoding='utf-8')
-            self.start_new_session(initial_prompt)
+            # self.system_prompt存在时直接复用；否则读取文件（进程内只读取一次）
+            if not self.system_prompt:
+                self.system_prompt = _load_initial_prompt()
+            self.start_new_session(self.system_prompt)
             time.sleep(2)
             return True  # 返回True表示开启了新会话
         return False  # 返回False表示没有开启新会话（token足够）
@@ -222,40 +377,17 @@ class DeepSeekClient:
             max_tokens: 最大输出token数（必须指定，根据预估输出长度设置）
             use_json_mode: 是否使用JSON模式（强制输出JSON格式），默认True
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-        
         # 直接使用传入的max_tokens（已经在调用前根据预估输出长度设置好）
         max_output = max_tokens
         
         # 估算当前请求的输入token数（用于错误信息显示）
         estimated_input_tokens = self.current_tokens
+        self._last_content_tokens = 0
         
-        # 构建请求数据，符合DeepSeek API规范
-        data = {
-            "model": self.model,
-            "messages": self.session_messages,
-            "temperature": TEMPERATURE,
-            "max_tokens": max_output,
-            "stream": False,  # 不使用流式输出
-        }
-        
-        # 如果使用reasoner模型，启用思考模式以保证生成质量
-        # 思考模式会让模型进行推理思考，生成质量更高，但速度稍慢
-        if "reasoner" in self.model.lower():
-            data["thinking"] = {
-                "type": "enabled"  # 启用思考模式，保证生成质量
-            }
-        
-        # 使用JSON模式可以确保输出是有效的JSON格式
-        # 注意：使用JSON模式时，prompt中必须明确要求生成JSON
-        if use_json_mode:
-            data["response_format"] = {
-                "type": "json_object"
-            }
+        # 构建请求数据：在固定部分上补充本次请求的messages和max_tokens
+        data = {**self._base_payload, "messages": self.session_messages, "max_tokens": max_output}
+        if not use_json_mode:
+            del data["response_format"]
         
         try:
             # 发送请求，增加连接和读取超时设置
@@ -265,10 +397,10 @@ class DeepSeekClient:
             # - 第二个值(1800): 读取超时，表示从服务器接收数据的最大等待时间
             #   如果30分钟内没有收到任何数据，会抛出Timeout异常
             #   对于大数据量生成，需要足够长的读取超时时间
-            response = requests.post(
+            response = self._session.post(
                 DEEPSEEK_API_BASE, 
-                headers=headers, 
-                json=data, 
+                headers=self._headers, 
+                data=_json_dumps(data), 
                 timeout=(30, 1800),  # (连接超时30秒, 读取超时1800秒=30分钟)
                 stream=False  # 不使用流式，确保完整接收响应
             )
@@ -281,7 +413,10 @@ class DeepSeekClient:
             
             # 尝试解析JSON
             try:
-                result = response.json()
+                if orjson is not None:
+                    result = orjson.loads(response.content)
+                else:
+                    result = response.json()
             except json.JSONDecodeError as json_err:
                 print(f"⚠️  警告: JSON解析失败，响应可能不完整")
                 print(f"响应状态码: {response.status_code}")
@@ -291,9 +426,9 @@ class DeepSeekClient:
                 # 尝试从响应中提取usage信息（即使JSON解析失败，usage可能在响应中）
                 try:
                     # 尝试用正则表达式提取usage信息
-                    usage_match = re.search(r'"usage"\s*:\s*\{[^}]+\}', response.text)
+                    usage_match = _USAGE_RE.search(response.content)
                     if usage_match:
-                        usage_str = usage_match.group(0)
+                        usage_str = usage_match.group(0).decode('utf-8', errors='replace')
                         print(f"   检测到usage信息: {usage_str}")
                 except:
                     pass
@@ -349,6 +484,7 @@ class DeepSeekClient:
                         completion_details = usage["completion_tokens_details"]
                         reasoning_tokens = completion_details.get("reasoning_tokens", 0)
                         content_tokens = completion_tokens - reasoning_tokens
+                    self._last_content_tokens = completion_tokens - reasoning_tokens
                 
                 if finish_reason == "length":
                     # 检查是否是reasoner模型且只有推理token没有内容token
@@ -429,9 +565,9 @@ class DeepSeekClient:
                     print(f"   响应状态码: {e.response.status_code}")
                     # 尝试从响应文本中提取usage信息
                     try:
-                        usage_match = re.search(r'"usage"\s*:\s*\{[^}]+\}', e.response.text)
+                        usage_match = _USAGE_RE.search(e.response.content)
                         if usage_match:
-                            print(f"   检测到usage信息: {usage_match.group(0)}")
+                            print(f"   检测到usage信息: {usage_match.group(0).decode('utf-8', errors='replace')}")
                     except:
                         pass
                     print(f"   响应内容: {e.response.text[:500]}")
@@ -442,9 +578,9 @@ class DeepSeekClient:
             # 尝试从部分响应中提取usage信息
             try:
                 if hasattr(e, 'response') and e.response is not None:
-                    usage_match = re.search(r'"usage"\s*:\s*\{[^}]+\}', e.response.text)
+                    usage_match = _USAGE_RE.search(e.response.content)
                     if usage_match:
-                        print(f"   检测到usage信息: {usage_match.group(0)}")
+                        print(f"   检测到usage信息: {usage_match.group(0).decode('utf-8', errors='replace')}")
             except:
                 pass
             print(f"   提示: 服务器在传输过程中关闭了连接，可能是网络不稳定或服务器问题")
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+API请求限流器
+"""
+
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """令牌桶限流器（线程安全，所有worker共享一个实例）
+
+    令牌按 rate_per_sec 的速度持续补充，最多积累 capacity 个。
+    每次发起API请求前调用 acquire() 取走一个令牌，有令牌时立即返回，没有时阻塞到补充出令牌为止。
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate_per_sec: 每秒补充的令牌数（即长期平均的每秒请求数上限），必须大于0
+            capacity: 最多积累的令牌数（允许的突发请求数），默认取 max(1, rate_per_sec)
+        """
+        if rate_per_sec <= 0:
+            raise ValueError(f"rate_per_sec必须大于0: {rate_per_sec}")
+        self.rate = rate_per_sec
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_sec)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        """取走一个令牌，没有令牌时阻塞等待"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                # 等待期间释放锁，其他线程可以继续检查
+                self._cond.wait((1 - self._tokens) / self.rate)
@@ -4,17 +4,45 @@
 包含解析生成计划、构建生成指令等功能
 """
 
+import functools
+import re
 from pathlib import Path
-from typing import List, Tuple
+from typing import Tuple
 
 # 生成计划文件路径（相对于此文件）
 GENERATION_PLAN_FILE = Path(__file__).parent / "generation_plan.txt"
 
+# 章节标题关键字
+_SECTION_DOMAINS = '领域列表'
+_SECTION_TYPES = '模糊类型列表'
+_SECTION_ROUNDS = '对话轮次列表'
+_SECTION_INSTRUCTION = '生成指令'
 
-def parse_generation_plan() -> Tuple[List[str], List[str], List[str]]:
+# 代码提取用的预编译正则
+# 领域：最后一个"("到其后最后一个")"之间的内容，")"之后不能再有括号
+_DOMAIN_CODE_RE = re.compile(r'\(([^(]*)\)[^()]*$')
+# 模糊类型：第一个全角"（"之前的内容
+_TYPE_CODE_RE = re.compile(r'([^（]*)（')
+# 轮次：行首的连续数字
+_ROUND_NUM_RE = re.compile(r'\d+')
+
+# 生成指令模板，模块加载时构建一次
+_GENERATION_INSTRUCTION_TEMPLATE = """请生成{count}条数据，要求：
+1. 领域：{domain_line}
+2. 模糊类型：{type_line}
+3. 对话轮次：{round_line}
+4. 数据格式：必须输出为有效的JSON数组格式，每条数据为sharegpt格式（包含system和conversations字段）
+5. 每条数据必须是完整的对话，以【完整请求总结】结束
+6. 助手在信息不足时必须追问，在信息完整后必须总结
+"""
+
+
+@functools.lru_cache(maxsize=1)
+def parse_generation_plan() -> Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]:
     """解析generation_plan.txt，提取领域、模糊类型和轮次列表
     
     直接保存整行内容，不进行解析。
+    结果按进程缓存，返回不可变的元组，避免调用方修改缓存内容。
     文件格式：
     ## 领域列表（20个）
     美容美发 (Beauty_Hairdressing)
@@ -28,46 +56,45 @@ def parse_generation_plan() -> Tuple[List[str], List[str], List[str]]:
     ## 生成指令
     ...
     """
-    lines = GENERATION_PLAN_FILE.read_text(encoding='utf-8').split('\n')
-    
     domains = []
     types = []
     rounds = []
     
-    current_section = None
+    # 章节标题关键字 -> 该章节内容的保存列表
+    targets = {
+        _SECTION_DOMAINS: domains,
+        _SECTION_TYPES: types,
+        _SECTION_ROUNDS: rounds,
+    }
+    active = None  # 当前章节的保存列表
     
-    for line in lines:
-        line_stripped = line.strip()
-        
-        # 跳过空行
-        if not line_stripped:
-            continue
-        
-        # 检测章节标题（格式：## 标题）
-        if line_stripped.startswith('##'):
-            if '领域列表' in line_stripped:
-                current_section = 'domains'
+    # 逐行读取，遇到"生成指令"章节即停止，不读取其后的内容；
+    # 按str去除首尾空白，全角空格、不换行空格等Unicode空白组成的行同样视为空行
+    with GENERATION_PLAN_FILE.open('r', encoding='utf-8') as f:
+        for line in f:
+            line_stripped = line.strip()
+            
+            # 跳过空行
+            if not line_stripped:
                 continue
-            elif '模糊类型列表' in line_stripped:
-                current_section = 'types'
-                continue
-            elif '对话轮次列表' in line_stripped:
-                current_section = 'rounds'
-                continue
-            elif '生成指令' in line_stripped:
-                # 遇到"生成指令"章节，停止解析
-                break
-            else:
+            
+            # 检测章节标题（格式：## 标题）
+            if line_stripped.startswith('##'):
+                target = next((t for keyword, t in targets.items() if keyword in line_stripped), None)
+                if target is not None:
+                    active = target
+                elif _SECTION_INSTRUCTION in line_stripped:
+                    # 遇到"生成指令"章节，停止解析
+                    break
                 # 其他##开头的行，跳过
                 continue
-        
-        # 直接保存整行内容
-        if current_section == 'domains':
-            domains.append(line_stripped)
-        elif current_section == 'types':
-            types.append(line_stripped)
-        elif current_section == 'rounds':
-            rounds.append(line_stripped)
+            
+            # 不在任何章节内的行直接跳过
+            if active is None:
+                continue
+            
+            # 直接保存整行内容
+            active.append(line_stripped)
     
     # 验证解析结果
     if not domains:
@@ -77,38 +104,25 @@ def parse_generation_plan() -> Tuple[List[str], List[str], List[str]]:
     if not rounds:
         raise ValueError("未找到任何对话轮次")
     
-    return domains, types, rounds
+    return tuple(domains), tuple(types), tuple(rounds)
 
 
 def extract_domain_code(domain_line: str) -> str:
     """从领域行中提取代码，例如 "美容美发 (Beauty_Hairdressing)" -> "Beauty_Hairdressing" """
-    if '(' in domain_line and ')' in domain_line:
-        start = domain_line.rfind('(')
-        end = domain_line.rfind(')')
-        if start < end:
-            return domain_line[start+1:end].strip()
-    return ""
+    match = _DOMAIN_CODE_RE.search(domain_line)
+    return match.group(1).strip() if match else ""
 
 
 def extract_type_code(type_line: str) -> str:
     """从模糊类型行中提取代码，例如 "condition_missing（条件缺失）" -> "condition_missing" """
-    if '（' in type_line:
-        return type_line[:type_line.find('（')].strip()
-    return ""
+    match = _TYPE_CODE_RE.match(type_line)
+    return match.group(1).strip() if match else ""
 
 
 def extract_round_num(round_line: str) -> int:
     """从轮次行中提取数字，例如 "1轮：..." -> 1 """
-    if round_line and round_line[0].isdigit():
-        num_str = ''
-        for char in round_line:
-            if char.isdigit():
-                num_str += char
-            else:
-                break
-        if num_str:
-            return int(num_str)
-    return 0
+    match = _ROUND_NUM_RE.match(round_line)
+    return int(match.group()) if match else 0
 
 
 def build_generation_instruction(domain_line: str, type_line: str, round_line: str, count: int = 50) -> str:
@@ -120,13 +134,9 @@ def build_generation_instruction(domain_line: str, type_line: str, round_line: s
         round_line: 轮次行
         count: 需要生成的数据条数，默认50条
     """
-    instruction = f"""请生成{count}条数据，要求：
-1. 领域：{domain_line}
-2. 模糊类型：{type_line}
-3. 对话轮次：{round_line}
-4. 数据格式：必须输出为有效的JSON数组格式，每条数据为sharegpt格式（包含system和conversations字段）
-5. 每条数据必须是完整的对话，以【完整请求总结】结束
-6. 助手在信息不足时必须追问，在信息完整后必须总结
-"""
-    
-    return instruction
+    return _GENERATION_INSTRUCTION_TEMPLATE.format(
+        count=count,
+        domain_line=domain_line,
+        type_line=type_line,
+        round_line=round_line,
+    )
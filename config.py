@@ -21,12 +21,15 @@ TOKENS_PER_ITEM_BY_ROUND = {
     4: 481,   # 4轮：每条约481 tokens（实际平均：482，范围：443-576）
     5: 425,   # 5轮：每条约425 tokens（实际平均：426，范围：395-468）
 }
+# 运行时根据API返回的实际输出token数，按轮次维护每条数据token数的指数加权平均（EWMA）
+# 上表作为下限，实际观测值更大时按观测值估算；该值为新观测值的权重
+TOKENS_PER_ITEM_EWMA_ALPHA = 0.3
 
 # 任务配置
 TARGET_ITEMS_PER_TASK = 50  # 每个任务的目标数据条数
 MAX_RETRIES = 3  # 最多重试次数
 RETRY_DELAY = 2  # 重试延迟（秒）
-SUCCESS_DELAY = 3  # 成功处理后的延迟（秒）
+API_RPS = 1  # 所有worker合计每秒最多发起的API请求数（令牌桶限流，避免API限流）
 
 # 并发配置
 ENABLE_CONCURRENCY = True  # 是否启用并发，默认True
@@ -5,17 +5,24 @@
 检查每条数据的conversations字段中"from": "human"和"from": "gpt"的数量是否匹配且与轮次一致
 """
 
+import functools
 import json
 import os
 from pathlib import Path
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List, Tuple
 
+from json_io import STREAM_PARSE_ERRORS, dumps_compact_array, iter_json_items, load_json, orjson
+
 # 数据根目录（从脚本所在位置向上查找项目根目录）
 SCRIPT_DIR = Path(__file__).parent.resolve()
 PROJECT_ROOT = SCRIPT_DIR.parent
 DATA_ROOT = PROJECT_ROOT / "data" / "cautious_secretary_raw"
 
+# 各维度（领域/轮次/模糊类型）统计的字段，顺序即输出顺序
+STAT_FIELDS = ("files", "data_before", "data_after", "removed")
+
 # 统计信息
 stats = {
     "total_files": 0,
@@ -24,35 +31,32 @@ stats = {
     "total_removed": 0,
     "files_processed": 0,
     "files_with_removals": 0,
-    "by_domain": defaultdict(lambda: {
-        "files": 0,
-        "data_before": 0,
-        "data_after": 0,
-        "removed": 0
-    }),
-    "by_round": defaultdict(lambda: {
-        "files": 0,
-        "data_before": 0,
-        "data_after": 0,
-        "removed": 0
-    }),
-    "by_ambiguity_type": defaultdict(lambda: {
-        "files": 0,
-        "data_before": 0,
-        "data_after": 0,
-        "removed": 0
-    }),
+    "by_domain": defaultdict(Counter),
+    "by_round": defaultdict(Counter),
+    "by_ambiguity_type": defaultdict(Counter),
     "error_details": []
 }
 
 
+def dump_json(file_path: Path, data) -> None:
+    """写入JSON文件，缩进2格（优先使用orjson），用于统计结果等供人查看的文件"""
+    if orjson is not None:
+        file_path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        return
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+@functools.lru_cache(maxsize=None)
 def extract_round_number(filename: str) -> int:
     """从文件名中提取轮次数"""
     # 文件名格式: 1_round.json, 2_round.json, etc.
-    try:
-        return int(filename.split('_')[0])
-    except (ValueError, IndexError):
+    i = filename.find('_')
+    if i <= 0:
         return 0
+    head = filename[:i]
+    # isdecimal而非isdigit：上标数字等字符isdigit为True但int()无法解析
+    return int(head) if head.isdecimal() else 0
 
 
 def check_conversation(data_item: dict, expected_rounds: int) -> Tuple[bool, str]:
@@ -73,24 +77,24 @@ def check_conversation(data_item: dict, expected_rounds: int) -> Tuple[bool, str
     if not isinstance(conversations, list):
         return False, "conversations不是list类型"
     
-    human_count = 0
-    gpt_count = 0
-    last_gpt_value = None
-    
+    # 按顺序检查每个元素，遇到第一个问题即返回；同时收集from字段，计数交给C层的list.count完成
+    froms = []
     for conv in conversations:
         if not isinstance(conv, dict):
             return False, "conversations中的元素不是dict类型"
-        
         if "from" not in conv:
             return False, "conversation中缺少from字段"
-        
-        if conv["from"] == "human":
-            human_count += 1
-        elif conv["from"] == "gpt":
-            gpt_count += 1
-            # 记录最后一个gpt的value
-            if "value" in conv:
-                last_gpt_value = conv["value"]
+        froms.append(conv["from"])
+    
+    human_count = froms.count("human")
+    gpt_count = froms.count("gpt")
+    
+    # 从后向前查找最后一个带value的gpt对话
+    last_gpt_value = next(
+        (conv["value"] for conv in reversed(conversations)
+         if conv["from"] == "gpt" and "value" in conv),
+        None
+    )
     
     # 检查数量是否匹配
     if human_count != gpt_count:
@@ -121,104 +125,146 @@ def process_file(file_path: Path) -> Tuple[int, int, List[str]]:
         (原始数据数量, 清理后数据数量, 错误信息列表)
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        items = iter_json_items(file_path)
     except Exception as e:
         return 0, 0, [f"读取文件失败: {str(e)}"]
     
-    if not isinstance(data, list):
+    if items is None:
         return 0, 0, [f"文件内容不是list类型"]
     
     expected_rounds = extract_round_number(file_path.name)
     if expected_rounds == 0:
         return 0, 0, [f"无法从文件名提取轮次数: {file_path.name}"]
     
-    original_count = len(data)
-    valid_data = []
+    original_count = 0
+    bad_indices = set()
     errors = []
     
-    for idx, item in enumerate(data):
-        is_valid, error_msg = check_conversation(item, expected_rounds)
-        if is_valid:
-            valid_data.append(item)
-        else:
-            errors.append(f"数据项#{idx+1}: {error_msg}")
+    # 第一遍只记录无效数据的下标，不构建清理后的列表
+    try:
+        for idx, item in enumerate(items):
+            original_count += 1
+            is_valid, error_msg = check_conversation(item, expected_rounds)
+            if not is_valid:
+                bad_indices.add(idx)
+                errors.append(f"数据项#{idx+1}: {error_msg}")
+    except STREAM_PARSE_ERRORS as e:
+        # 流式解析时文件中途损坏，按读取失败处理
+        return 0, 0, [f"读取文件失败: {str(e)}"]
     
-    # 保存清理后的数据
-    if len(valid_data) != original_count:
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(valid_data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            errors.append(f"保存文件失败: {str(e)}")
+    # 全部有效（绝大多数文件）：无需构建新列表，也无需写回
+    if not bad_indices:
+        return original_count, original_count, errors
     
-    return original_count, len(valid_data), errors
+    # 保存清理后的数据（流式解析时数据未保留在内存中，需要重新读取）
+    # 与生成脚本写出的数据文件格式一致：紧凑、每条一行
+    try:
+        data = items if isinstance(items, list) else load_json(file_path)
+        valid_data = [item for idx, item in enumerate(data) if idx not in bad_indices]
+        file_path.write_bytes(dumps_compact_array(valid_data))
+    except Exception as e:
+        errors.append(f"保存文件失败: {str(e)}")
+    
+    return original_count, original_count - len(bad_indices), errors
+
+
+def _scan_sorted(directory) -> List[os.DirEntry]:
+    """列出目录下的所有条目，按名称排序"""
+    with os.scandir(directory) as it:
+        return sorted(it, key=lambda entry: entry.name)
 
 
 def process_all_files():
-    """处理所有文件"""
+    """处理所有文件
+    
+    先收集所有轮次文件，再用进程池并行解析和校验；
+    统计信息只在主进程中按原有顺序汇总，输出顺序与串行处理一致。
+    """
     if not DATA_ROOT.exists():
         print(f"错误: 数据目录不存在: {DATA_ROOT}")
         return
     
-    # 遍历所有领域文件夹
-    for domain_dir in sorted(DATA_ROOT.iterdir()):
-        if not domain_dir.is_dir():
+    # 收集所有待处理文件: [(领域, [(模糊类型, [轮次文件, ...]), ...]), ...]
+    # 使用os.scandir遍历，DirEntry自带文件类型信息，无需逐个stat
+    plan = []
+    for domain_entry in _scan_sorted(DATA_ROOT):
+        if not domain_entry.is_dir():
             continue
         
-        domain_name = domain_dir.name
-        print(f"\n处理领域: {domain_name}")
-        
-        # 遍历所有模糊类型文件夹
-        for ambiguity_dir in sorted(domain_dir.iterdir()):
-            if not ambiguity_dir.is_dir():
+        ambiguities = []
+        for ambiguity_entry in _scan_sorted(domain_entry.path):
+            if not ambiguity_entry.is_dir():
                 continue
+            round_files = [
+                Path(entry.path) for entry in _scan_sorted(ambiguity_entry.path)
+                if entry.name.endswith("_round.json") and entry.is_file()
+            ]
+            ambiguities.append((ambiguity_entry.name, round_files))
+        plan.append((domain_entry.name, ambiguities))
+    
+    round_files = [f for _, ambiguities in plan for _, files in ambiguities for f in files]
+    
+    # 不指定max_workers：默认取CPU核数，Windows上自动限制在61以内
+    with ProcessPoolExecutor() as executor:
+        # executor.map按提交顺序返回结果
+        results = executor.map(process_file, round_files, chunksize=8)
+        
+        # 遍历所有领域文件夹
+        for domain_name, ambiguities in plan:
+            print(f"\n处理领域: {domain_name}")
             
-            ambiguity_type = ambiguity_dir.name
-            print(f"  处理模糊类型: {ambiguity_type}")
-            
-            # 遍历所有轮次文件
-            for round_file in sorted(ambiguity_dir.glob("*_round.json")):
-                stats["total_files"] += 1
-                round_num = extract_round_number(round_file.name)
-                
-                print(f"    处理文件: {round_file.name}", end=" ... ")
-                
-                original_count, valid_count, errors = process_file(round_file)
-                removed_count = original_count - valid_count
+            # 遍历所有模糊类型文件夹
+            for ambiguity_type, files in ambiguities:
+                print(f"  处理模糊类型: {ambiguity_type}")
                 
-                # 更新统计信息
-                stats["total_data_before"] += original_count
-                stats["total_data_after"] += valid_count
-                stats["total_removed"] += removed_count
-                stats["files_processed"] += 1
-                
-                stats["by_domain"][domain_name]["files"] += 1
-                stats["by_domain"][domain_name]["data_before"] += original_count
-                stats["by_domain"][domain_name]["data_after"] += valid_count
-                stats["by_domain"][domain_name]["removed"] += removed_count
-                
-                stats["by_round"][round_num]["files"] += 1
-                stats["by_round"][round_num]["data_before"] += original_count
-                stats["by_round"][round_num]["data_after"] += valid_count
-                stats["by_round"][round_num]["removed"] += removed_count
-                
-                stats["by_ambiguity_type"][ambiguity_type]["files"] += 1
-                stats["by_ambiguity_type"][ambiguity_type]["data_before"] += original_count
-                stats["by_ambiguity_type"][ambiguity_type]["data_after"] += valid_count
-                stats["by_ambiguity_type"][ambiguity_type]["removed"] += removed_count
-                
-                if removed_count > 0:
-                    stats["files_with_removals"] += 1
-                    print(f"移除了 {removed_count} 条数据")
-                    if errors:
-                        stats["error_details"].append({
-                            "file": str(round_file),
-                            "removed": removed_count,
-                            "errors": errors[:5]  # 只保存前5个错误
-                        })
-                else:
-                    print(f"通过 ({valid_count} 条数据)")
+                # 遍历所有轮次文件
+                for round_file in files:
+                    stats["total_files"] += 1
+                    round_num = extract_round_number(round_file.name)
+                    
+                    print(f"    处理文件: {round_file.name}", end=" ... ")
+                    
+                    original_count, valid_count, errors = next(results)
+                    removed_count = original_count - valid_count
+                    
+                    # 更新统计信息
+                    stats["total_data_before"] += original_count
+                    stats["total_data_after"] += valid_count
+                    stats["total_removed"] += removed_count
+                    stats["files_processed"] += 1
+                    
+                    # 每个文件只构造一次增量，三个维度各做一次Counter.update
+                    delta = dict(zip(STAT_FIELDS, (1, original_count, valid_count, removed_count)))
+                    stats["by_domain"][domain_name].update(delta)
+                    stats["by_round"][round_num].update(delta)
+                    stats["by_ambiguity_type"][ambiguity_type].update(delta)
+                    
+                    if removed_count > 0:
+                        stats["files_with_removals"] += 1
+                        print(f"移除了 {removed_count} 条数据")
+                        if errors:
+                            stats["error_details"].append({
+                                "file": str(round_file),
+                                "removed": removed_count,
+                                "errors": errors[:5]  # 只保存前5个错误
+                            })
+                    else:
+                        print(f"通过 ({valid_count} 条数据)")
+
+
+def _print_breakdown(title: str, axis_stats, label=str) -> None:
+    """按key排序打印某个维度的统计信息"""
+    print(f"\n{title}:")
+    for key in sorted(axis_stats):
+        d = axis_stats[key]
+        print(f"  {label(key)}:")
+        print(f"    文件数: {d['files']}")
+        print(f"    数据(清理前): {d['data_before']}")
+        print(f"    数据(清理后): {d['data_after']}")
+        print(f"    删除数: {d['removed']}")
+        if d['data_before'] > 0:
+            rate = d['removed'] / d['data_before'] * 100
+            print(f"    删除率: {rate:.2f}%")
 
 
 def print_statistics():
@@ -238,41 +284,9 @@ def print_statistics():
         removal_rate = stats['total_removed'] / stats['total_data_before'] * 100
         print(f"  删除率: {removal_rate:.2f}%")
     
-    print(f"\n按领域统计:")
-    for domain in sorted(stats['by_domain'].keys()):
-        d = stats['by_domain'][domain]
-        print(f"  {domain}:")
-        print(f"    文件数: {d['files']}")
-        print(f"    数据(清理前): {d['data_before']}")
-        print(f"    数据(清理后): {d['data_after']}")
-        print(f"    删除数: {d['removed']}")
-        if d['data_before'] > 0:
-            rate = d['removed'] / d['data_before'] * 100
-            print(f"    删除率: {rate:.2f}%")
-    
-    print(f"\n按轮次统计:")
-    for round_num in sorted(stats['by_round'].keys()):
-        r = stats['by_round'][round_num]
-        print(f"  {round_num}_round:")
-        print(f"    文件数: {r['files']}")
-        print(f"    数据(清理前): {r['data_before']}")
-        print(f"    数据(清理后): {r['data_after']}")
-        print(f"    删除数: {r['removed']}")
-        if r['data_before'] > 0:
-            rate = r['removed'] / r['data_before'] * 100
-            print(f"    删除率: {rate:.2f}%")
-    
-    print(f"\n按模糊类型统计:")
-    for amb_type in sorted(stats['by_ambiguity_type'].keys()):
-        a = stats['by_ambiguity_type'][amb_type]
-        print(f"  {amb_type}:")
-        print(f"    文件数: {a['files']}")
-        print(f"    数据(清理前): {a['data_before']}")
-        print(f"    数据(清理后): {a['data_after']}")
-        print(f"    删除数: {a['removed']}")
-        if a['data_before'] > 0:
-            rate = a['removed'] / a['data_before'] * 100
-            print(f"    删除率: {rate:.2f}%")
+    _print_breakdown("按领域统计", stats['by_domain'])
+    _print_breakdown("按轮次统计", stats['by_round'], label=lambda round_num: f"{round_num}_round")
+    _print_breakdown("按模糊类型统计", stats['by_ambiguity_type'])
     
     if stats['error_details']:
         print(f"\n错误详情 (前10个):")
@@ -283,9 +297,14 @@ def print_statistics():
                 print(f"     - {err}")
 
 
+def _materialize(axis_stats) -> Dict[str, Dict[str, int]]:
+    """将某个维度的Counter统计转换为按STAT_FIELDS排列的普通dict"""
+    return {str(key): {field: counts[field] for field in STAT_FIELDS} for key, counts in axis_stats.items()}
+
+
 def save_statistics():
     """保存统计信息到JSON文件"""
-    # 将defaultdict转换为普通dict以便JSON序列化
+    # 将defaultdict/Counter转换为普通dict以便JSON序列化
     stats_json = {
         "total_files": stats["total_files"],
         "total_data_before": stats["total_data_before"],
@@ -293,16 +312,15 @@ def save_statistics():
         "total_removed": stats["total_removed"],
         "files_processed": stats["files_processed"],
         "files_with_removals": stats["files_with_removals"],
-        "by_domain": dict(stats["by_domain"]),
-        "by_round": {str(k): v for k, v in stats["by_round"].items()},
-        "by_ambiguity_type": dict(stats["by_ambiguity_type"]),
+        "by_domain": _materialize(stats["by_domain"]),
+        "by_round": _materialize(stats["by_round"]),
+        "by_ambiguity_type": _materialize(stats["by_ambiguity_type"]),
         "error_details": stats["error_details"][:20]  # 只保存前20个错误详情
     }
     
     # 输出文件保存在脚本所在目录
     output_file = SCRIPT_DIR / "conversation_check_stats.json"
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(stats_json, f, ensure_ascii=False, indent=2)
+    dump_json(output_file, stats_json)
     
     print(f"\n统计信息已保存到: {output_file}")
 
@@ -9,19 +9,49 @@
 2. 从每个轮次 JSON 文件中提取指定数量的数据（默认全部）
 3. 排除模式：排除指定的文件或文件夹
 4. 添加模式：只添加指定的文件或文件夹
+5. 输出格式：JSON 数组（默认）或 JSON Lines（每行一条，边读边写）
 """
 
-import json
+import contextlib
+import functools
+import io
+import os
+import sys
 import argparse
 from pathlib import Path
-from typing import List, Set, Optional
-from collections import defaultdict
+from typing import FrozenSet, List, Set, Optional, Tuple
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from json_io import dumps_array_item, dumps_jsonl_line, load_json
 
 # 数据根目录（从脚本所在位置向上查找项目根目录）
 SCRIPT_DIR = Path(__file__).parent.resolve()
 PROJECT_ROOT = SCRIPT_DIR.parent
 DATA_ROOT = PROJECT_ROOT / "data" / "cautious_secretary_raw"
 
+# 逐文件的处理日志先缓存，每累积这么多条统一写出一次
+LOG_FLUSH_LINES = 256
+
+
+@functools.lru_cache(maxsize=None)
+def _case_insensitive_index() -> dict:
+    """
+    DATA_ROOT 下所有文件和目录的小写相对路径索引（只遍历一次目录树）
+    
+    使用 os.walk 按字符串遍历，不为每个条目构造 Path 对象。
+    
+    Returns:
+        {小写相对路径: 完整路径字符串}，同名（忽略大小写）时保留遍历顺序中的第一个
+    """
+    index = {}
+    root_len = len(str(DATA_ROOT)) + 1  # 去掉 "DATA_ROOT/" 前缀得到相对路径
+    for dirpath, dirnames, filenames in os.walk(DATA_ROOT):
+        for name in dirnames + filenames:
+            full_path = os.path.join(dirpath, name)
+            index.setdefault(full_path[root_len:].lower(), full_path)
+    return index
+
 
 def normalize_path(path_str: str) -> Path:
     """
@@ -51,46 +81,55 @@ def normalize_path(path_str: str) -> Path:
     
     # 如果路径不存在，尝试查找匹配的文件或目录
     if not full_path.exists():
-        # 尝试查找匹配的文件（忽略大小写）
-        path_str_lower = path_str_normalized.lower()
-        for existing_path in DATA_ROOT.rglob("*"):
-            if str(existing_path.relative_to(DATA_ROOT)).lower() == path_str_lower:
-                return existing_path
+        # 尝试查找匹配的文件（忽略大小写），索引在第一次未命中时构建
+        existing_path = _case_insensitive_index().get(path_str_normalized.lower())
+        if existing_path is not None:
+            return Path(existing_path)
     
     return full_path
 
 
-def is_path_under(parent_path: Path, child_path: Path) -> bool:
+def build_path_filter(paths: Optional[Set[Path]]) -> Tuple[Tuple[str, ...], FrozenSet[str]]:
     """
-    检查 child_path 是否在 parent_path 下（兼容 Python 3.8+）
+    将排除/包含路径预处理为相对于 DATA_ROOT 的字符串，只在过滤前做一次
+    
+    每个路径只调用一次 is_dir()，之后逐文件判断时不再访问文件系统。
     
     Args:
-        parent_path: 父路径
-        child_path: 子路径
+        paths: 排除或包含的路径集合
     
     Returns:
-        True 如果 child_path 在 parent_path 下
+        (目录前缀元组，均以 "/" 结尾, 文件相对路径集合)
     """
-    try:
-        # Python 3.9+ 支持 is_relative_to
-        if hasattr(child_path, 'is_relative_to'):
-            return child_path.is_relative_to(parent_path)
+    dir_prefixes = []
+    file_paths = set()
+    for path in paths or ():
+        try:
+            rel_str = path.relative_to(DATA_ROOT).as_posix()
+        except ValueError:
+            # 不在 DATA_ROOT 下的路径不可能匹配任何数据文件
+            continue
+        if path.is_dir():
+            # DATA_ROOT 本身的相对路径为 "."，对应空前缀（匹配所有文件）
+            dir_prefixes.append("" if rel_str == "." else rel_str + "/")
         else:
-            # Python 3.8 使用 relative_to 方法
-            child_path.relative_to(parent_path)
-            return True
-    except (ValueError, AttributeError):
-        return False
+            file_paths.add(rel_str)
+    return tuple(dir_prefixes), frozenset(file_paths)
 
 
-def should_include_file(file_path: Path, exclude_paths: Set[Path], include_paths: Optional[Set[Path]], mode: str) -> bool:
+def should_include_file(
+    file_path: Path,
+    exclude_filter: Tuple[Tuple[str, ...], FrozenSet[str]],
+    include_filter: Tuple[Tuple[str, ...], FrozenSet[str]],
+    mode: str
+) -> bool:
     """
     判断文件是否应该被包含
     
     Args:
         file_path: 要检查的文件路径
-        exclude_paths: 排除路径集合
-        include_paths: 包含路径集合（仅在添加模式下使用）
+        exclude_filter: build_path_filter 生成的排除路径
+        include_filter: build_path_filter 生成的包含路径（仅在添加模式下使用）
         mode: 'exclude' 或 'include'
     
     Returns:
@@ -98,51 +137,20 @@ def should_include_file(file_path: Path, exclude_paths: Set[Path], include_paths
     """
     # 将文件路径转换为相对于 DATA_ROOT 的路径
     try:
-        rel_path = file_path.relative_to(DATA_ROOT)
+        rel_str = file_path.relative_to(DATA_ROOT).as_posix()
     except ValueError:
         # 如果文件不在 DATA_ROOT 下，返回 False
         return False
     
-    # 检查排除模式
+    # 检查排除模式：文件本身或其任何父目录在排除列表中则排除
     if mode == 'exclude':
-        # 检查文件本身是否在排除列表中
-        if file_path in exclude_paths:
-            return False
-        
-        # 检查文件的任何父目录是否在排除列表中
-        for exclude_path in exclude_paths:
-            # 如果排除路径是目录，检查文件是否在该目录下
-            if exclude_path.is_dir():
-                if is_path_under(exclude_path, file_path):
-                    return False
-            # 如果排除路径是文件，直接比较
-            elif exclude_path.is_file():
-                if file_path == exclude_path:
-                    return False
-        
-        return True
+        dir_prefixes, file_paths = exclude_filter
+        return not (rel_str in file_paths or rel_str.startswith(dir_prefixes))
     
-    # 检查添加模式
+    # 检查添加模式：文件本身或其任何父目录在包含列表中才包含
     elif mode == 'include':
-        if include_paths is None or len(include_paths) == 0:
-            return False
-        
-        # 检查文件本身是否在包含列表中
-        if file_path in include_paths:
-            return True
-        
-        # 检查文件的任何父目录是否在包含列表中
-        for include_path in include_paths:
-            # 如果包含路径是目录，检查文件是否在该目录下
-            if include_path.is_dir():
-                if is_path_under(include_path, file_path):
-                    return True
-            # 如果包含路径是文件，直接比较
-            elif include_path.is_file():
-                if file_path == include_path:
-                    return True
-        
-        return False
+        dir_prefixes, file_paths = include_filter
+        return rel_str in file_paths or rel_str.startswith(dir_prefixes)
     
     return True
 
@@ -159,8 +167,7 @@ def load_json_file(file_path: Path, max_items: Optional[int] = None) -> List[dic
         数据列表
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = load_json(file_path)
         
         if not isinstance(data, list):
             print(f"警告: {file_path} 不是数组格式，跳过")
@@ -176,6 +183,24 @@ def load_json_file(file_path: Path, max_items: Optional[int] = None) -> List[dic
         return []
 
 
+def _load_file_task(file_path: Path, max_items: Optional[int], output_format: str) -> Tuple[str, int, object]:
+    """
+    进程池任务：读取单个 JSON 文件
+    
+    读取过程中的警告信息随结果一起返回，由主进程按文件顺序打印；
+    数据直接在子进程中序列化好，主进程只需写入字节。
+    
+    Returns:
+        (警告信息, 数据条数, 序列化后的字节：jsonl 为若干行，json 为以 ",\n" 连接的数组元素)
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        data = load_json_file(file_path, max_items)
+    if output_format == 'jsonl':
+        return log.getvalue(), len(data), b"".join(map(dumps_jsonl_line, data))
+    return log.getvalue(), len(data), b",\n".join(map(dumps_array_item, data))
+
+
 def find_all_json_files(data_root: Path) -> List[Path]:
     """
     查找所有 *_round.json 文件
@@ -186,9 +211,36 @@ def find_all_json_files(data_root: Path) -> List[Path]:
     Returns:
         所有 JSON 文件路径列表
     """
+    # 用栈和 os.scandir 遍历目录树，DirEntry 自带文件类型信息，
+    # 只为匹配的文件构造 Path，中间目录不再逐个创建 Path 对象
     json_files = []
-    for round_file in data_root.rglob("*_round.json"):
-        json_files.append(round_file)
+    stack = [str(data_root)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith("_round.json"):
+                    json_files.append(Path(entry.path))
+    return sorted(json_files)
+
+
+def find_included_json_files(include_paths: Set[Path]) -> List[Path]:
+    """
+    添加模式下只遍历包含路径，不再扫描整个数据目录
+    
+    Args:
+        include_paths: 包含路径集合（目录或文件）
+    
+    Returns:
+        包含路径下所有 *_round.json 文件路径列表（已去重、排序）
+    """
+    json_files = set()
+    for include_path in include_paths:
+        if include_path.is_dir():
+            json_files.update(find_all_json_files(include_path))
+        elif include_path.name.endswith("_round.json"):
+            json_files.add(include_path)
     return sorted(json_files)
 
 
@@ -196,7 +248,8 @@ def consolidate_data(
     output_file: Optional[str] = None,
     max_items_per_file: Optional[int] = None,
     mode: str = 'exclude',
-    paths: List[str] = None
+    paths: List[str] = None,
+    output_format: str = 'json'
 ):
     """
     整理数据到新的 JSON 文件
@@ -206,6 +259,7 @@ def consolidate_data(
         max_items_per_file: 每个文件最多提取的数据条数，None 表示全部
         mode: 'exclude' 或 'include'
         paths: 排除或包含的路径列表
+        output_format: 'json'（JSON 数组）或 'jsonl'（每行一条）；两种格式都边读边写，不在内存中累积
     """
     if paths is None:
         paths = []
@@ -214,7 +268,7 @@ def consolidate_data(
     if output_file is None:
         output_dir = PROJECT_ROOT / "output_dataset"
         output_dir.mkdir(exist_ok=True)
-        output_file = str(output_dir / "consolidated_data.json")
+        output_file = str(output_dir / f"consolidated_data.{output_format}")
         print(f"使用默认输出路径: {output_file}")
     
     # 规范化路径
@@ -256,35 +310,26 @@ def consolidate_data(
         print(f"错误: 数据目录不存在: {DATA_ROOT}")
         return
     
-    # 查找所有 JSON 文件
-    print(f"\n正在查找所有数据文件...")
-    all_json_files = find_all_json_files(DATA_ROOT)
+    # 查找所有 JSON 文件（添加模式下只查找包含路径）
+    if mode == 'include':
+        print(f"\n正在查找包含路径下的数据文件...")
+        all_json_files = find_included_json_files(include_paths)
+    else:
+        print(f"\n正在查找所有数据文件...")
+        all_json_files = find_all_json_files(DATA_ROOT)
     print(f"找到 {len(all_json_files)} 个 JSON 文件")
     
     # 过滤文件
     print(f"\n正在过滤文件...")
+    exclude_filter = build_path_filter(exclude_paths)
+    include_filter = build_path_filter(include_paths)
     filtered_files = []
     for file_path in all_json_files:
-        if should_include_file(file_path, exclude_paths, include_paths, mode):
+        if should_include_file(file_path, exclude_filter, include_filter, mode):
             filtered_files.append(file_path)
     
     print(f"过滤后剩余 {len(filtered_files)} 个文件")
     
-    # 收集所有数据
-    print(f"\n正在收集数据...")
-    all_data = []
-    stats = defaultdict(int)
-    
-    for file_path in filtered_files:
-        data = load_json_file(file_path, max_items_per_file)
-        if data:
-            all_data.extend(data)
-            # 统计信息
-            rel_path = file_path.relative_to(DATA_ROOT)
-            domain = rel_path.parts[0] if len(rel_path.parts) > 0 else "unknown"
-            stats[domain] += len(data)
-            print(f"  已处理: {rel_path} ({len(data)} 条数据)")
-    
     # 处理输出文件路径：如果是相对路径，则相对于脚本目录
     output_path = Path(output_file)
     if not output_path.is_absolute():
@@ -293,21 +338,76 @@ def consolidate_data(
     # 确保输出目录存在
     output_path.parent.mkdir(parents=True, exist_ok=True)
     
-    # 保存到输出文件
-    print(f"\n正在保存到 {output_path}...")
+    # 先打开输出文件，收集时逐个文件写入
+    # 写入临时文件，全部成功后再替换为输出文件，中途出错不会破坏已有的输出文件
+    jsonl = output_format == 'jsonl'
+    tmp_path = output_path.with_name(output_path.name + '.tmp')
+    print(f"\n正在写入 {output_path}...")
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(all_data, f, ensure_ascii=False, indent=2)
-        print(f"✅ 成功保存 {len(all_data)} 条数据到 {output_path}")
+        output_f = open(tmp_path, 'wb')
     except Exception as e:
         print(f"❌ 保存文件失败: {str(e)}")
         return
     
+    # 收集所有数据
+    print(f"\n正在收集数据...")
+    total_count = 0
+    stats = Counter()  # 按领域统计数据条数
+    log_lines = []  # 待写出的逐文件日志
+    
+    try:
+        with output_f:
+            if not jsonl:
+                output_f.write(b"[")
+            # 各文件之间互不依赖，用进程池并行解析；executor.map按提交顺序返回结果，
+            # 写入和统计只在主进程中进行，输出顺序与串行处理一致；
+            # 不指定max_workers：默认取CPU核数，Windows上自动限制在61以内
+            with ProcessPoolExecutor() as executor:
+                results = executor.map(
+                    _load_file_task,
+                    filtered_files,
+                    [max_items_per_file] * len(filtered_files),
+                    [output_format] * len(filtered_files),
+                    chunksize=8
+                )
+                for file_path, (log, count, data) in zip(filtered_files, results):
+                    if log:
+                        log_lines.append(log)
+                    if count:
+                        if not jsonl:
+                            output_f.write(b",\n" if total_count else b"\n")
+                        output_f.write(data)
+                        total_count += count
+                        # 统计信息
+                        rel_path = file_path.relative_to(DATA_ROOT)
+                        domain = rel_path.parts[0] if len(rel_path.parts) > 0 else "unknown"
+                        stats[domain] += count
+                        log_lines.append(f"  已处理: {rel_path} ({count} 条数据)\n")
+                    if len(log_lines) >= LOG_FLUSH_LINES:
+                        sys.stdout.write("".join(log_lines))
+                        log_lines.clear()
+            if not jsonl:
+                output_f.write(b"\n]" if total_count else b"]")
+        os.replace(tmp_path, output_path)
+    except OSError as e:
+        tmp_path.unlink(missing_ok=True)
+        sys.stdout.write("".join(log_lines))
+        print(f"❌ 保存文件失败: {str(e)}")
+        return
+    except BaseException:
+        # 其他异常（包括子进程出错和用户中断）同样清理临时文件后继续抛出
+        tmp_path.unlink(missing_ok=True)
+        raise
+    
+    sys.stdout.write("".join(log_lines))
+    
+    print(f"✅ 成功保存 {total_count} 条数据到 {output_path}")
+    
     # 打印统计信息
     print(f"\n{'='*80}")
     print("统计信息")
     print(f"{'='*80}")
-    print(f"总数据条数: {len(all_data)}")
+    print(f"总数据条数: {total_count}")
     print(f"处理文件数: {len(filtered_files)}")
     print(f"\n按领域统计:")
     for domain in sorted(stats.keys()):
@@ -346,12 +446,15 @@ def main():
      python consolidate_data.py --max-items 10
      # 将输出到 output_dataset/consolidated_data.json
 
+  9. 输出为 JSON Lines（每行一条，边读边写）:
+     python consolidate_data.py output.jsonl --format jsonl
+
 路径格式说明:
   - 可以使用相对路径: "Beauty_Hairdressing/condition_missing/2_round.json"
   - 可以使用绝对路径: "C:/path/to/data/cautious_secretary_raw/Beauty_Hairdressing/..."
   - 路径会自动规范化，支持 Windows 和 Unix 风格路径
   - 输出文件路径：相对路径将相对于脚本所在目录
-  - 如果不指定输出文件，将使用默认路径：output_dataset/consolidated_data.json
+  - 如果不指定输出文件，将使用默认路径：output_dataset/consolidated_data.json（jsonl 格式为 consolidated_data.jsonl）
         """
     )
     
@@ -386,6 +489,14 @@ def main():
         help='要排除或包含的路径列表（文件或文件夹）'
     )
     
+    parser.add_argument(
+        '--format',
+        type=str,
+        choices=['json', 'jsonl'],
+        default='json',
+        help='输出格式：json（JSON 数组，默认）或 jsonl（每行一条，边读边写，内存占用低）'
+    )
+    
     args = parser.parse_args()
     
     # 验证参数
@@ -398,7 +509,8 @@ def main():
         output_file=args.output_file,
         max_items_per_file=args.max_items,
         mode=args.mode,
-        paths=args.paths
+        paths=args.paths,
+        output_format=args.format
     )
 
 
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据处理脚本共用的JSON读写函数
+check_conversations.py、consolidate_data.py、split_conversations.py 都从这里导入，
+流式解析阈值、解析错误类型和序列化格式只在这一处定义
+"""
+
+import json
+import mmap
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时回退到标准库json
+    orjson = None
+
+try:
+    import ijson
+    STREAM_PARSE_ERRORS = (ijson.JSONError,)
+except ImportError:  # 未安装ijson时始终整体解析
+    ijson = None
+    STREAM_PARSE_ERRORS = ()
+
+# 超过该大小的JSON数组使用ijson流式解析（小文件整体解析更快）
+STREAM_PARSE_THRESHOLD = 64 * 1024
+# 超过该大小的文件整体解析时通过mmap读取
+MMAP_PARSE_THRESHOLD = 64 * 1024
+
+
+def load_json(file_path: Path):
+    """读取JSON文件（优先使用orjson）
+
+    使用orjson时，大文件通过mmap直接交给解析器，省去一次读入bytes的内存拷贝。
+    """
+    if orjson is not None:
+        if file_path.stat().st_size > MMAP_PARSE_THRESHOLD:
+            with open(file_path, 'rb') as f:
+                try:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError):
+                    # 部分平台/文件系统不支持mmap，退回普通读取
+                    mm = None
+                if mm is not None:
+                    with mm, memoryview(mm) as view:
+                        return orjson.loads(view)
+        return orjson.loads(file_path.read_bytes())
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _stream_jsonl(file_path: Path) -> Iterator[Any]:
+    """逐行产出JSON Lines文件中的数据，跳过空行"""
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
+
+def _stream_json_array(file_path: Path) -> Iterator[Any]:
+    """逐条产出JSON数组中的元素"""
+    with open(file_path, 'rb') as f:
+        yield from ijson.items(f, 'item', use_float=True)
+
+
+def iter_json_items(file_path: Path) -> Optional[Iterable[Any]]:
+    """
+    返回文件中各条数据的可迭代对象，JSON文件内容不是数组时返回None
+
+    .jsonl 文件逐行读取；较大的JSON数组在安装了ijson时流式解析，
+    不必先把整个文件读入内存，否则整体读取并返回列表。
+    流式解析时文件中途损坏的错误在迭代过程中才抛出（见 STREAM_PARSE_ERRORS）。
+    """
+    if file_path.suffix == '.jsonl':
+        return _stream_jsonl(file_path)
+
+    if ijson is not None and file_path.stat().st_size > STREAM_PARSE_THRESHOLD:
+        with open(file_path, 'rb') as f:
+            head = f.read(64).lstrip()
+        if head.startswith(b'['):
+            return _stream_json_array(file_path)
+
+    data = load_json(file_path)
+    return data if isinstance(data, list) else None
+
+
+def dumps_jsonl_line(record) -> bytes:
+    """将一条数据序列化为JSON Lines的一行（以换行结尾）"""
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def dumps_array_item(record) -> bytes:
+    """
+    将一条数据序列化为缩进2格的JSON数组元素（不含分隔符）
+    逐条写出后与整体 json.dump(indent=2) 的结果逐字节一致
+    """
+    if orjson is not None:
+        text = orjson.dumps(record, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else:
+        text = json.dumps(record, ensure_ascii=False, indent=2).encode('utf-8')
+    # JSON字符串中的换行已转义，这里的换行都是缩进换行
+    return b"  " + text.replace(b"\n", b"\n  ")
+
+
+def dumps_compact_array(records) -> bytes:
+    """
+    将数据序列化为紧凑的JSON数组（每条一行，以 ",\n" 分隔）
+    与 utils.save_json_data 生成的数据文件格式一致，用于重写数据文件
+    """
+    if not records:
+        return b"[]"
+    if orjson is not None:
+        items = b",\n".join(orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS) for record in records)
+    else:
+        items = ",\n".join(
+            json.dumps(record, ensure_ascii=False, separators=(',', ':')) for record in records
+        ).encode('utf-8')
+    return b"[\n" + items + b"\n]"
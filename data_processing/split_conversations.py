@@ -7,12 +7,26 @@
 使用方法：
 1. 先运行 consolidate_data.py 生成 consolidated_data.json
 2. 然后运行此脚本：python split_conversations.py
+3. 加 --format jsonl 可输出为 JSON Lines（每行一条，边拆分边写入）
 """
 
+import itertools
 import json
+import os
 import argparse
+from collections import Counter
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import Dict, Any, Iterator, Optional
+
+from json_io import (
+    STREAM_PARSE_ERRORS,
+    dumps_array_item,
+    dumps_jsonl_line,
+    iter_json_items,
+)
+
+# 读取输入时可能出现的解析错误（流式读取时在处理过程中才会抛出）
+INPUT_PARSE_ERRORS = (ValueError,) + STREAM_PARSE_ERRORS
 
 # 脚本所在目录
 SCRIPT_DIR = Path(__file__).parent.resolve()
@@ -20,19 +34,19 @@ PROJECT_ROOT = SCRIPT_DIR.parent
 DEFAULT_INPUT_FILE = PROJECT_ROOT / "output_dataset" / "consolidated_data.json"
 DEFAULT_OUTPUT_FILE = PROJECT_ROOT / "output_dataset" / "alpaca_format_data.json"
 
-
-def split_conversation(original_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+def split_conversation(original_data: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
     """
     将一条多轮对话拆分成多个单轮回复训练样本
     
     Args:
         original_data: 原始对话数据，包含 system 和 conversations 字段
         
-    Returns:
-        训练样本列表，每个样本为Alpaca格式
+    Yields:
+        训练样本，Alpaca格式
     """
-    training_samples = []
-    history = []  # 存储历史对话对 [["user1", "gpt1"], ["user2", "gpt2"], ...]
+    # 存储历史对话对 (("user1", "gpt1"), ("user2", "gpt2"), ...)
+    # 使用不可变元组，各样本直接共享同一份历史，无需逐轮复制；序列化后与列表相同
+    history = ()
     system = original_data.get("system", "")
     conversations = original_data.get("conversations", [])
     
@@ -56,37 +70,34 @@ def split_conversation(original_data: Dict[str, Any]) -> List[Dict[str, Any]]:
             }
             
             # 添加历史对话（不包括当前轮次）
-            if history:
-                sample["history"] = history.copy()
-            else:
-                sample["history"] = []
+            sample["history"] = history
             
             # 如果system为空，可以删除该字段（可选）
             if not sample["system"]:
                 sample.pop("system", None)
             
-            training_samples.append(sample)
+            yield sample
             
             # 将当前轮次的对话对加入历史（用于下一轮）
             if current_user_input:
-                history.append([current_user_input, gpt_response])
+                history += ((current_user_input, gpt_response),)
                 current_user_input = None
-    
-    return training_samples
 
 
 def process_data(
     input_file: str,
     output_file: str,
-    max_samples: Optional[int] = None
+    max_samples: Optional[int] = None,
+    output_format: str = 'json'
 ) -> None:
     """
     处理数据文件，将多轮对话拆分成训练样本
     
     Args:
-        input_file: 输入JSON文件路径
+        input_file: 输入JSON文件路径（.jsonl 后缀按 JSON Lines 读取，均尽量流式读取）
         output_file: 输出JSON文件路径
         max_samples: 最大处理样本数（用于测试），None表示处理全部
+        output_format: 'json'（JSON数组）或 'jsonl'（每行一条，边拆分边写入）
     """
     input_path = Path(input_file)
     if not input_path.exists():
@@ -95,57 +106,101 @@ def process_data(
     
     print(f"正在读取输入文件: {input_path}")
     try:
-        with open(input_path, 'r', encoding='utf-8') as f:
-            original_data_list = json.load(f)
+        original_data_items = iter_json_items(input_path)
     except Exception as e:
         print(f"错误: 读取文件失败: {str(e)}")
         return
     
-    if not isinstance(original_data_list, list):
+    if original_data_items is None:
         print("错误: 输入文件格式不正确，应为JSON数组")
         return
     
-    print(f"找到 {len(original_data_list)} 条原始对话数据")
+    # 整体读取时可以预先知道总数；流式读取时在处理完成后统计
+    total_original = len(original_data_items) if isinstance(original_data_items, list) else None
+    if total_original is not None:
+        print(f"找到 {total_original} 条原始对话数据")
+    else:
+        print("流式读取原始对话数据，总数在处理完成后统计")
     
     # 限制处理数量（用于测试）
     if max_samples is not None and max_samples > 0:
-        original_data_list = original_data_list[:max_samples]
+        original_data_items = itertools.islice(original_data_items, max_samples)
+        if total_original is not None:
+            total_original = min(total_original, max_samples)
         print(f"限制处理数量为: {max_samples}")
     
+    output_path = Path(output_file)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    
+    # 先打开输出文件，拆分时逐条写入，不在内存中累积训练样本
+    # 写入临时文件，全部成功后再替换为输出文件，中途出错不会留下不完整的输出文件
+    jsonl = output_format == 'jsonl'
+    tmp_path = output_path.with_name(output_path.name + '.tmp')
+    print(f"\n正在写入输出文件: {output_path}")
+    try:
+        output_f = open(tmp_path, 'wb')
+    except Exception as e:
+        print(f"❌ 保存文件失败: {str(e)}")
+        return
+    
     # 处理每条数据
-    all_training_samples = []
+    first_sample = None  # 第一条训练样本（用于打印示例）
+    history_sample = None  # 第一条带历史对话的训练样本（用于打印示例）
     stats = {
-        "total_original": len(original_data_list),
+        "total_original": 0,
         "total_training_samples": 0,
-        "conversations_by_rounds": {}  # 统计不同轮次的数量
+        "conversations_by_rounds": Counter()  # 统计不同轮次的数量
     }
+    rounds_counter = stats["conversations_by_rounds"]
     
     print(f"\n正在处理数据...")
-    for idx, original_data in enumerate(original_data_list):
-        if idx % 1000 == 0 and idx > 0:
-            print(f"  已处理 {idx}/{len(original_data_list)} 条原始数据...")
-        
-        samples = split_conversation(original_data)
-        all_training_samples.extend(samples)
-        
-        # 统计轮次
-        num_rounds = len(samples)
-        stats["conversations_by_rounds"][num_rounds] = stats["conversations_by_rounds"].get(num_rounds, 0) + 1
-    
-    stats["total_training_samples"] = len(all_training_samples)
-    
-    # 保存输出文件
-    output_path = Path(output_file)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    
-    print(f"\n正在保存到输出文件: {output_path}")
+    total_samples = 0
+    processed = 0  # 已处理的原始对话数
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(all_training_samples, f, ensure_ascii=False, indent=2)
-        print(f"✅ 成功保存 {len(all_training_samples)} 条训练样本到 {output_path}")
-    except Exception as e:
+        with output_f:
+            if not jsonl:
+                output_f.write(b"[")
+            for original_data in original_data_items:
+                if processed % 1000 == 0 and processed > 0:
+                    progress = f"{processed}/{total_original}" if total_original is not None else processed
+                    print(f"  已处理 {progress} 条原始数据...")
+                
+                num_rounds = 0
+                for sample in split_conversation(original_data):
+                    if jsonl:
+                        output_f.write(dumps_jsonl_line(sample))
+                    else:
+                        output_f.write((b",\n" if total_samples else b"\n") + dumps_array_item(sample))
+                    total_samples += 1
+                    num_rounds += 1
+                    
+                    if first_sample is None:
+                        first_sample = sample
+                    if history_sample is None and sample.get("history"):
+                        history_sample = sample
+                
+                # 统计轮次
+                rounds_counter[num_rounds] += 1
+                processed += 1
+            if not jsonl:
+                output_f.write(b"\n]" if total_samples else b"]")
+        os.replace(tmp_path, output_path)
+    except INPUT_PARSE_ERRORS as e:
+        tmp_path.unlink(missing_ok=True)
+        print(f"错误: 读取文件失败（已处理 {processed} 条原始数据）: {str(e)}")
+        return
+    except OSError as e:
+        tmp_path.unlink(missing_ok=True)
         print(f"❌ 保存文件失败: {str(e)}")
         return
+    except BaseException:
+        # 其他异常（包括用户中断）同样清理临时文件后继续抛出
+        tmp_path.unlink(missing_ok=True)
+        raise
+    
+    stats["total_original"] = processed
+    stats["total_training_samples"] = total_samples
+    print(f"✅ 成功保存 {total_samples} 条训练样本到 {output_path}")
     
     # 打印统计信息
     print(f"\n{'='*80}")
@@ -155,22 +210,20 @@ def process_data(
     print(f"生成的训练样本: {stats['total_training_samples']} 条")
     print(f"平均每条对话生成: {stats['total_training_samples'] / stats['total_original']:.2f} 条训练样本")
     print(f"\n按轮次统计（原始对话的轮次数）:")
-    for rounds in sorted(stats["conversations_by_rounds"].keys()):
-        count = stats["conversations_by_rounds"][rounds]
+    for rounds in sorted(rounds_counter.keys()):
+        count = rounds_counter[rounds]
         print(f"  {rounds} 轮对话: {count} 条")
     print(f"{'='*80}")
     
     # 打印示例
-    if all_training_samples:
+    if first_sample is not None:
         print(f"\n示例训练样本（第1条）:")
-        print(json.dumps(all_training_samples[0], ensure_ascii=False, indent=2))
-        if len(all_training_samples) > 1:
+        print(json.dumps(first_sample, ensure_ascii=False, indent=2))
+        if stats["total_training_samples"] > 1:
             print(f"\n示例训练样本（第2条，如果有历史对话）:")
-            # 找一个有历史对话的样本
-            for sample in all_training_samples:
-                if sample.get("history"):
-                    print(json.dumps(sample, ensure_ascii=False, indent=2))
-                    break
+            # 拆分时记录的第一条有历史对话的样本
+            if history_sample is not None:
+                print(json.dumps(history_sample, ensure_ascii=False, indent=2))
 
 
 def main():
@@ -191,9 +244,13 @@ def main():
   4. 组合使用:
      python split_conversations.py --input data.json --output train.json --max-samples 1000
 
+  5. 输出为 JSON Lines（每行一条，边拆分边写入）:
+     python split_conversations.py --input consolidated_data.jsonl --format jsonl
+
 默认路径:
   - 输入: output_dataset/consolidated_data.json
-  - 输出: output_dataset/alpaca_format_data.json
+  - 输出: output_dataset/alpaca_format_data.json（jsonl 格式为 alpaca_format_data.jsonl）
+  - 输入文件后缀为 .jsonl 时按 JSON Lines 读取
         """
     )
     
@@ -207,8 +264,8 @@ def main():
     parser.add_argument(
         '--output',
         type=str,
-        default=str(DEFAULT_OUTPUT_FILE),
-        help=f'输出JSON文件路径（默认: {DEFAULT_OUTPUT_FILE}）'
+        default=None,
+        help=f'输出JSON文件路径（默认: {DEFAULT_OUTPUT_FILE}，jsonl 格式时后缀为 .jsonl）'
     )
     
     parser.add_argument(
@@ -218,13 +275,26 @@ def main():
         help='最大处理样本数（用于测试），None表示处理全部'
     )
     
+    parser.add_argument(
+        '--format',
+        type=str,
+        choices=['json', 'jsonl'],
+        default='json',
+        help='输出格式：json（JSON数组，默认）或 jsonl（每行一条，边拆分边写入，内存占用低）'
+    )
+    
     args = parser.parse_args()
     
+    output_file = args.output
+    if output_file is None:
+        output_file = str(DEFAULT_OUTPUT_FILE.with_suffix(f".{args.format}"))
+    
     # 执行处理
     process_data(
         input_file=args.input,
-        output_file=args.output,
-        max_samples=args.max_samples
+        output_file=output_file,
+        max_samples=args.max_samples,
+        output_format=args.format
     )
 
 
@@ -5,13 +5,13 @@
 """
 
 import os
+import threading
 import time
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
-from typing import Tuple
+from typing import TYPE_CHECKING, NamedTuple, Tuple
 
-from client import DeepSeekClient
+from client import DeepSeekClient, TokenBucket, create_http_session
 from client.deepseek_client import (
     DEEPSEEK_API_KEY,
     MODEL_NAME,
@@ -34,8 +34,33 @@ from utils import (
     save_json_data,
 )
 
+if TYPE_CHECKING:
+    import requests
 
-def generate_single_task(client: DeepSeekClient, domain_line: str, type_line: str, round_line: str, initial_prompt: str) -> bool:
+
+class GenerationTask(NamedTuple):
+    """一个生成任务（领域 × 模糊类型 × 轮次）"""
+    domain_line: str
+    type_line: str
+    round_line: str
+    domain_code: str
+    type_code: str
+    round_num: int
+    output_file: Path
+    task_index: int
+
+
+def build_output_file(domain_code: str, type_code: str, round_num: int) -> Path:
+    """任务的输出文件路径：OUTPUT_BASE_DIR/领域代码/类型代码/N_round.json"""
+    return config.OUTPUT_BASE_DIR / domain_code / type_code / f"{round_num}_round.json"
+
+
+# 所有worker共享的API请求限流器，每次发送请求前取一个令牌
+_rate_limiter = TokenBucket(config.API_RPS)
+
+
+def generate_single_task(client: DeepSeekClient, domain_line: str, type_line: str, round_line: str, initial_prompt: str,
+                         domain_code: str, type_code: str, round_num: int, output_file: Path) -> bool:
     """生成单个任务的数据（50条）
     
     每个任务开始时重置会话（只保留system prompt），然后通过多轮对话生成数据。
@@ -47,12 +72,11 @@ def generate_single_task(client: DeepSeekClient, domain_line: str, type_line: st
         type_line: 类型行
         round_line: 轮次行
         initial_prompt: 初始prompt（避免重复读取文件）
+        domain_code: 领域代码（构建任务列表时已提取）
+        type_code: 类型代码
+        round_num: 对话轮次
+        output_file: 输出文件路径（由 build_output_file 构建）
     """
-    # 提取代码用于构建文件路径
-    domain_code = extract_domain_code(domain_line)
-    type_code = extract_type_code(type_line)
-    round_num = extract_round_num(round_line)
-    
     print(f"\n{'='*80}")
     print(f"📝 开始生成: {domain_line} - {type_line} - {round_line}")
     print(f"{'='*80}")
@@ -60,9 +84,6 @@ def generate_single_task(client: DeepSeekClient, domain_line: str, type_line: st
     # 每个任务开始时重置会话（只保留system prompt）
     client.reset_session(initial_prompt)
     
-    # 构建文件路径
-    output_file = config.OUTPUT_BASE_DIR / domain_code / type_code / f"{round_num}_round.json"
-    
     # 检查已有数据量
     initial_count = count_data_items(output_file)
     if initial_count >= config.TARGET_ITEMS_PER_TASK:
@@ -87,7 +108,7 @@ def generate_single_task(client: DeepSeekClient, domain_line: str, type_line: st
     if estimated_output_tokens > max_allowed:
         print(f"⚠️  预估输出token数({estimated_output_tokens})超过模型最大限制({max_allowed})，调整数据量...")
         # 根据最大限制反推可以生成的数据量
-        tokens_per_item = config.TOKENS_PER_ITEM_BY_ROUND.get(round_num, 1000)
+        tokens_per_item = client.tokens_per_item(round_num)
         adjusted_count = int(max_allowed / (tokens_per_item * 1.2))
         if adjusted_count < 1:
             adjusted_count = 1
@@ -105,6 +126,7 @@ def generate_single_task(client: DeepSeekClient, domain_line: str, type_line: st
     
     # 注意：由于任务开始时已重置会话（只有system prompt），token肯定足够，无需检查
     # 发送生成指令（作为user message），使用估算的output_tokens作为max_tokens
+    _rate_limiter.acquire()  # 发送前从共享限流器取得令牌
     response = client.send_message(instruction, max_tokens=estimated_output_tokens)
     
     if not response:
@@ -116,8 +138,9 @@ def generate_single_task(client: DeepSeekClient, domain_line: str, type_line: st
     json_data = extract_json_from_text(response)
     
     if json_data:
-        save_json_data(output_file, json_data)
-        current_count = count_data_items(output_file)
+        # 用实际输出更新每条数据的token数估算
+        client.record_output_items(round_num, len(json_data))
+        current_count = save_json_data(output_file, json_data)
         print(f"✅ 首次生成: {len(json_data)} 条数据")
     else:
         print("⚠️  未能从响应中提取JSON，尝试保存原始响应...")
@@ -154,7 +177,7 @@ def generate_single_task(client: DeepSeekClient, domain_line: str, type_line: st
         # 如果预估输出token数超过模型最大限制，调整needed数量
         if estimated_output_tokens > max_allowed:
             print(f"⚠️  预估输出token数({estimated_output_tokens})超过模型最大限制({max_allowed})，调整数据量...")
-            tokens_per_item = config.TOKENS_PER_ITEM_BY_ROUND.get(round_num, 1000)
+            tokens_per_item = client.tokens_per_item(round_num)
             adjusted_needed = int(max_allowed / (tokens_per_item * 1.2))
             if adjusted_needed < 1:
                 adjusted_needed = 1
@@ -172,6 +195,8 @@ def generate_single_task(client: DeepSeekClient, domain_line: str, type_line: st
         # 在发送请求前检查token是否足够，如果不够则开启新会话
         session_reset = client.ensure_session_ready(supplement_msg, estimated_output_tokens)
         
+        # 发送前从共享限流器取得令牌
+        _rate_limiter.acquire()
         if session_reset:
             # 如果开启了新会话，需要重新发送完整的生成指令
             # 因为新会话中没有之前的上下文，不能发送"补齐"指令
@@ -193,8 +218,8 @@ def generate_single_task(client: DeepSeekClient, domain_line: str, type_line: st
         json_data = extract_json_from_text(response)
         
         if json_data:
-            save_json_data(output_file, json_data)
-            current_count = count_data_items(output_file)
+            client.record_output_items(round_num, len(json_data))
+            current_count = save_json_data(output_file, json_data)
             retry_count = 0  # 成功则重置重试计数
         else:
             print("⚠️  未能从响应中提取JSON")
@@ -219,39 +244,45 @@ def generate_single_task(client: DeepSeekClient, domain_line: str, type_line: st
     # 任务完成后重置会话，准备下一个任务（复用已读取的initial_prompt）
     client.reset_session(initial_prompt)
     
-    # 短暂休息，避免API限流（只有在成功处理后才休息）
-    if current_count > 0:  # 如果有生成数据，说明进行了API请求
-        print(f"⏳ 等待{config.SUCCESS_DELAY}秒，避免API限流...")
-        time.sleep(config.SUCCESS_DELAY)
-    
     return current_count >= config.TARGET_ITEMS_PER_TASK
 
 
-def generate_task_wrapper(args: Tuple[str, str, str, str, int, int]) -> Tuple[int, bool, str]:
+# 每个worker线程复用一个client实例（见 generate_task_wrapper）
+_thread_local = threading.local()
+
+
+def generate_task_wrapper(task: GenerationTask, initial_prompt: str,
+                          http_session: "requests.Session") -> Tuple[int, bool, str]:
     """任务包装函数，用于并发执行
     
-    每个worker线程都会创建独立的client实例，确保线程安全。
+    每个worker线程第一次执行任务时创建自己的client实例，之后该线程的任务都复用它
+    （任务开始时会重置会话，线程之间的会话历史互不干扰）；
+    HTTP连接池则由所有worker共享，避免每个任务重新建立TCP/TLS连接。
     
     Args:
-        args: (domain_line, type_line, round_line, initial_prompt, task_index, total_tasks)
+        task: 要执行的生成任务
+        initial_prompt: 初始提示词（system prompt）
+        http_session: 所有worker共享的HTTP会话
     
     Returns:
         (task_index, success, error_message)
     """
-    domain_line, type_line, round_line, initial_prompt, task_index, total_tasks = args
-    
-    # 每个worker使用独立的client实例
-    client = DeepSeekClient(DEEPSEEK_API_KEY, model=MODEL_NAME)
+    # 每个worker线程使用独立的client实例，共享HTTP会话
+    client = getattr(_thread_local, 'client', None)
+    if client is None:
+        client = DeepSeekClient(DEEPSEEK_API_KEY, model=MODEL_NAME, session=http_session)
+        _thread_local.client = client
     
     try:
         success = generate_single_task(
-            client, domain_line, type_line, round_line, initial_prompt
+            client, task.domain_line, task.type_line, task.round_line, initial_prompt,
+            task.domain_code, task.type_code, task.round_num, task.output_file
         )
-        return (task_index, success, "")
+        return (task.task_index, success, "")
     except Exception as e:
         import traceback
         error_msg = f"{str(e)}\n{traceback.format_exc()}"
-        return (task_index, False, error_msg)
+        return (task.task_index, False, error_msg)
 
 
 def main():
@@ -298,16 +329,29 @@ def main():
     except Exception as e:
         print(f"⚠️  初始化未完成任务记录文件失败: {e}")
     
-    # 构建所有任务列表
+    # 构建任务列表（提前跳过已完成的任务，不再提交到线程池）
+    # 领域、类型代码和轮次只提取一次，输出文件路径也在这里构建好，直接传给任务
+    print("🔍 检查已完成的任务...")
+    domain_codes = [extract_domain_code(domain_line) for domain_line in domains]
+    type_codes = [extract_type_code(type_line) for type_line in types]
+    round_nums = [extract_round_num(round_line) for round_line in rounds]
     tasks = []
     task_index = 0
-    for domain_line in domains:
-        for type_line in types:
-            for round_line in rounds:
+    skipped_count = 0
+    for domain_line, domain_code in zip(domains, domain_codes):
+        for type_line, type_code in zip(types, type_codes):
+            for round_line, round_num in zip(rounds, round_nums):
+                output_file = build_output_file(domain_code, type_code, round_num)
+                if count_data_items(output_file) >= config.TARGET_ITEMS_PER_TASK:
+                    skipped_count += 1
+                    continue
                 task_index += 1
-                tasks.append((domain_line, type_line, round_line, task_index))
+                tasks.append(GenerationTask(domain_line, type_line, round_line, domain_code, type_code,
+                                            round_num, output_file, task_index))
     
     total_tasks = len(tasks)
+    if skipped_count:
+        print(f"⏭️  已跳过 {skipped_count} 个已完成任务，剩余 {total_tasks} 个任务")
     print(f"\n🤖 使用模型: {MODEL_NAME}")
     print(f"📊 配置信息:")
     if "reasoner" in MODEL_NAME.lower():
@@ -327,55 +371,47 @@ def main():
         print(f"\n🚀 使用并发模式执行，worker数量: {config.CONCURRENT_WORKERS}")
         print(f"📋 任务列表已构建，共 {total_tasks} 个任务，将并发执行")
         
-        # 准备任务参数（每个任务只添加一次，确保无重复）
-        task_args = []
-        for domain_line, type_line, round_line, task_idx in tasks:
-            task_args.append((
-                domain_line, type_line, round_line, initial_prompt,
-                task_idx, total_tasks
-            ))
+        # 所有worker共享一个HTTP会话，连接池大小按worker数量设置，保证每个worker都能复用连接
+        http_session = create_http_session(pool_maxsize=config.CONCURRENT_WORKERS * 2)
         
         # 使用线程池执行
         completed_count = 0
         success_count = 0
         failed_count = 0
-        progress_lock = Lock()
         
         try:
             with ThreadPoolExecutor(max_workers=config.CONCURRENT_WORKERS) as executor:
                 # 提交所有任务（每个任务只提交一次，确保无重复）
                 future_to_task = {
-                    executor.submit(generate_task_wrapper, args): args[4] 
-                    for args in task_args
+                    executor.submit(generate_task_wrapper, task, initial_prompt, http_session): task.task_index
+                    for task in tasks
                 }
                 
                 print(f"✅ 已提交 {len(future_to_task)} 个任务到线程池\n")
                 
-                # 处理完成的任务
+                # 处理完成的任务（as_completed在主线程中依次返回，计数和输出无需加锁）
                 for future in as_completed(future_to_task):
                     task_idx = future_to_task[future]
                     try:
                         task_idx_result, success, error_msg = future.result()
-                        with progress_lock:
-                            completed_count += 1
-                            if success:
-                                success_count += 1
-                                print(f"✅ 任务 {task_idx_result}/{total_tasks} 完成 (进度: {completed_count}/{total_tasks}, 成功: {success_count}, 失败: {failed_count})")
-                            else:
-                                failed_count += 1
-                                print(f"⚠️  任务 {task_idx_result}/{total_tasks} 未完全完成 (进度: {completed_count}/{total_tasks}, 成功: {success_count}, 失败: {failed_count})")
-                                if error_msg:
-                                    # 只显示第一行错误，避免输出过长
-                                    first_line = error_msg.split('\n')[0] if error_msg else ""
-                                    if first_line:
-                                        print(f"   错误: {first_line}")
-                    except Exception as e:
-                        with progress_lock:
-                            completed_count += 1
+                        completed_count += 1
+                        if success:
+                            success_count += 1
+                            print(f"✅ 任务 {task_idx_result}/{total_tasks} 完成 (进度: {completed_count}/{total_tasks}, 成功: {success_count}, 失败: {failed_count})")
+                        else:
                             failed_count += 1
-                            print(f"❌ 任务 {task_idx}/{total_tasks} 执行异常: {e}")
-                            import traceback
-                            traceback.print_exc()
+                            print(f"⚠️  任务 {task_idx_result}/{total_tasks} 未完全完成 (进度: {completed_count}/{total_tasks}, 成功: {success_count}, 失败: {failed_count})")
+                            if error_msg:
+                                # 只显示第一行错误，避免输出过长
+                                first_line = error_msg.split('\n')[0] if error_msg else ""
+                                if first_line:
+                                    print(f"   错误: {first_line}")
+                    except Exception as e:
+                        completed_count += 1
+                        failed_count += 1
+                        print(f"❌ 任务 {task_idx}/{total_tasks} 执行异常: {e}")
+                        import traceback
+                        traceback.print_exc()
         except KeyboardInterrupt:
             print(f"\n⚠️  用户中断，已处理 {completed_count}/{total_tasks} 个任务")
             raise
@@ -391,14 +427,15 @@ def main():
         success_count = 0
         failed_count = 0
         
-        for domain_line, type_line, round_line, task_idx in tasks:
+        for task in tasks:
             current_task += 1
             print(f"\n📊 进度: {current_task}/{total_tasks}")
             
             # 生成单个任务
             try:
                 success = generate_single_task(
-                    client, domain_line, type_line, round_line, initial_prompt
+                    client, task.domain_line, task.type_line, task.round_line, initial_prompt,
+                    task.domain_code, task.type_code, task.round_num, task.output_file
                 )
                 
                 if success:
@@ -420,6 +457,8 @@ def main():
     print(f"\n🎉 所有任务处理完成！")
     print(f"\n📊 统计信息:")
     print(f"   - 总任务数: {total_tasks}")
+    if skipped_count:
+        print(f"   - 此前已完成（跳过）: {skipped_count}")
     print(f"   - 已完成: {current_task}")
     print(f"   - 成功: {success_count}")
     print(f"   - 失败/未完成: {failed_count}")
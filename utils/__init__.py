@@ -4,12 +4,14 @@
 """
 
 from .utils import (
+    extract_json_fast,
     extract_json_from_text,
     count_data_items,
     save_json_data,
 )
 
 __all__ = [
+    'extract_json_fast',
     'extract_json_from_text',
     'count_data_items',
     'save_json_data',
@@ -5,9 +5,117 @@
 """
 
 import json
+import os
 import re
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时回退到标准库json
+    orjson = None
+
+# 用于从文本任意位置开始解析JSON（raw_decode返回解析结束的位置）
+_JSON_DECODER = json.JSONDecoder()
+
+# 预编译的正则表达式
+# Markdown代码块中的JSON（```json 或 ```，内容为数组或对象），一个正则覆盖所有形式
+_CODE_BLOCK_RE = re.compile(r'```(?:json)?\s*([\[\{][\s\S]*?[\]\}])\s*```', re.DOTALL)
+# 对象或数组末尾多余的逗号
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+# 独立的JSON对象
+_OBJECT_RE = re.compile(r'\{\s*"[^"]*"\s*:[\s\S]*?\}', re.DOTALL)
+# 数据文件中的 "system" 字段（按字节匹配）
+_SYSTEM_KEY_RE = re.compile(rb'"system"\s*:')
+
+# 截断数组中提取完整对象时，最多允许的解析失败次数
+PARTIAL_EXTRACT_MAX_FAILURES = 16
+# 在文本中查找JSON数组时，最多允许解析失败的"["个数
+ARRAY_SEARCH_MAX_FAILURES = 16
+
+# 数据条数缓存：{文件路径: (st_mtime_ns, st_size, 条数)}
+# 文件的修改时间和大小都没变时直接返回缓存的条数，无需重新读取文件
+_COUNT_CACHE: Dict[str, Tuple[int, int, int]] = {}
+# 数据条数同时记录在数据文件旁的 .count 文件中（内容为 "st_mtime_ns st_size 条数"），
+# 进程重启后内存缓存为空时也无需重新解析整个文件
+COUNT_FILE_SUFFIX = '.count'
+
+
+def _loads(s):
+    """解析JSON字符串或字节（优先使用orjson）
+    
+    orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，调用方统一捕获 json.JSONDecodeError 即可。
+    """
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+
+def _repair_json(json_str: str) -> str:
+    """修复模型输出中常见的JSON格式问题：末尾多余的逗号和 // 注释"""
+    # 移除末尾的逗号
+    json_str = _TRAILING_COMMA_RE.sub(r'\1', json_str)
+    # 移除注释行
+    lines = []
+    in_string = False
+    escape_next = False
+    for line in json_str.split('\n'):
+        cleaned_line = []
+        for char in line:
+            if escape_next:
+                cleaned_line.append(char)
+                escape_next = False
+                continue
+            if char == '\\':
+                escape_next = True
+                cleaned_line.append(char)
+            elif char == '"' and not escape_next:
+                in_string = not in_string
+                cleaned_line.append(char)
+            elif char == '/' and not in_string and len(cleaned_line) > 0 and cleaned_line[-1] == '/':
+                # 遇到 // 注释，移除这部分
+                cleaned_line.pop()
+                break
+            else:
+                cleaned_line.append(char)
+        lines.append(''.join(cleaned_line))
+    return '\n'.join(lines)
+
+
+def _find_data_list(data) -> Optional[List[Dict]]:
+    """从解析结果中取出数据数组：非空数组直接返回，对象则查找其中的非空数组字段"""
+    # 如果是数组，直接返回
+    if isinstance(data, list) and len(data) > 0:
+        return data
+    # 如果是对象，检查是否包含数组字段（常见格式：{"data": [...]}）
+    if isinstance(data, dict):
+        # 查找包含数组的字段
+        for key, value in data.items():
+            if isinstance(value, list) and len(value) > 0:
+                return value
+        # 如果没有找到数组字段，但对象本身可能就是我们需要的（单个对象包装成数组）
+        # 这种情况通常不会发生，但为了兼容性保留
+    return None
+
+
+def extract_json_fast(text: str) -> Optional[List[Dict]]:
+    """只处理整个文本就是JSON的情况（快速路径）
+    
+    使用 response_format: {"type": "json_object"} 时，绝大多数响应都属于这种情况，
+    只需整体解析一次。解析失败且文本以[开头时（可能被截断），提取已生成的完整数据。
+    其余情况返回None，由 extract_json_from_text 的后备方法处理。
+    """
+    text_stripped = text.strip()
+    if not (text_stripped.startswith('[') or text_stripped.startswith('{')):
+        return None
+    try:
+        data = _loads(text_stripped)
+    except json.JSONDecodeError:
+        # JSON解析失败，可能是被截断了，尝试从截断的数组中提取完整的对象
+        if text_stripped.startswith('['):
+            return _extract_partial_json_array(text_stripped)
+        return None
+    return _find_data_list(data)
 
 
 def extract_json_from_text(text: str) -> Optional[List[Dict]]:
@@ -15,117 +123,57 @@ def extract_json_from_text(text: str) -> Optional[List[Dict]]:
     
     当使用 response_format: {"type": "json_object"} 时，
     DeepSeek API 返回的 content 字段直接就是 JSON 字符串（可能是对象或数组）。
-    如果 content 本身就是有效的 JSON，直接解析即可。
+    如果 content 本身就是有效的 JSON，直接解析即可（见 extract_json_fast），
+    只有快速路径失败时才依次尝试代码块、数组查找等后备方法。
     
     如果达到max_tokens限制导致响应被截断，会尝试提取已生成的完整数据，
     即使最后一条数据不完整也会返回已解析的完整数据。
     """
     # 方法0: 如果整个文本就是有效的JSON（使用json_object模式时的情况）
-    text_stripped = text.strip()
-    if text_stripped.startswith('[') or text_stripped.startswith('{'):
-        try:
-            data = json.loads(text_stripped)
-            # 如果是数组，直接返回
-            if isinstance(data, list) and len(data) > 0:
-                return data
-            # 如果是对象，检查是否包含数组字段（常见格式：{"data": [...]}）
-            if isinstance(data, dict):
-                # 查找包含数组的字段
-                for key, value in data.items():
-                    if isinstance(value, list) and len(value) > 0:
-                        return value
-                # 如果没有找到数组字段，但对象本身可能就是我们需要的（单个对象包装成数组）
-                # 这种情况通常不会发生，但为了兼容性保留
-        except json.JSONDecodeError:
-            # JSON解析失败，可能是被截断了，尝试提取部分数据
-            if text_stripped.startswith('['):
-                # 尝试从截断的数组中提取完整的对象
-                return _extract_partial_json_array(text_stripped)
-            pass  # 继续尝试其他方法
+    data = extract_json_fast(text)
+    if data:
+        return data
     
     # 方法1: 尝试从代码块中提取（兼容非JSON模式或模型在代码块中输出JSON的情况）
-    code_block_patterns = [
-        r'```json\s*(\[[\s\S]*?\])\s*```',
-        r'```json\s*(\{[\s\S]*?\})\s*```',
-        r'```\s*(\[[\s\S]*?\])\s*```',
-        r'```\s*(\{[\s\S]*?\})\s*```',
-    ]
-    
-    for pattern in code_block_patterns:
-        match = re.search(pattern, text, re.DOTALL)
-        if match:
-            json_str = match.group(1)
-            try:
-                data = json.loads(json_str)
-                if isinstance(data, list) and len(data) > 0:
-                    return data
-                # 如果是对象，查找数组字段
-                if isinstance(data, dict):
-                    for key, value in data.items():
-                        if isinstance(value, list) and len(value) > 0:
-                            return value
-            except json.JSONDecodeError:
-                continue
-    
-    # 方法2: 查找最外层的JSON数组
-    # 使用括号匹配来找到完整的数组
-    bracket_count = 0
-    start_idx = -1
+    # 一次扫描依次取出各个代码块（```json 或 ```，内容为数组或对象），返回第一个包含数据的
+    for match in _CODE_BLOCK_RE.finditer(text):
+        try:
+            data = _find_data_list(_loads(match.group(1)))
+        except json.JSONDecodeError:
+            continue
+        if data:
+            return data
     
-    for i, char in enumerate(text):
-        if char == '[':
-            if bracket_count == 0:
-                start_idx = i
-            bracket_count += 1
-        elif char == ']':
-            bracket_count -= 1
-            if bracket_count == 0 and start_idx != -1:
-                json_str = text[start_idx:i+1]
+    # 方法2: 查找JSON数组
+    # 由解码器（C实现）从"["开始解析并确定数组结尾，不再逐字符匹配括号；
+    # 某个"["解析失败时继续查找下一个"["，失败次数达到上限后放弃
+    start_idx = text.find('[')
+    failures = 0
+    while start_idx != -1:
+        try:
+            data, end_idx = _JSON_DECODER.raw_decode(text, start_idx)
+        except json.JSONDecodeError:
+            # 尝试修复常见问题（末尾逗号、注释）后重新解析
+            close_idx = text.rfind(']')
+            if close_idx > start_idx:
                 try:
-                    data = json.loads(json_str)
+                    data, _ = _JSON_DECODER.raw_decode(_repair_json(text[start_idx:close_idx+1]))
                     if isinstance(data, list) and len(data) > 0:
                         return data
                 except json.JSONDecodeError:
-                    # 尝试修复常见问题
-                    try:
-                        # 移除末尾的逗号
-                        json_str = re.sub(r',(\s*[}\]])', r'\1', json_str)
-                        # 移除注释行
-                        lines = []
-                        in_string = False
-                        escape_next = False
-                        for line in json_str.split('\n'):
-                            cleaned_line = []
-                            for char in line:
-                                if escape_next:
-                                    cleaned_line.append(char)
-                                    escape_next = False
-                                    continue
-                                if char == '\\':
-                                    escape_next = True
-                                    cleaned_line.append(char)
-                                elif char == '"' and not escape_next:
-                                    in_string = not in_string
-                                    cleaned_line.append(char)
-                                elif char == '/' and not in_string and len(cleaned_line) > 0 and cleaned_line[-1] == '/':
-                                    # 遇到 // 注释，移除这部分
-                                    cleaned_line.pop()
-                                    break
-                                else:
-                                    cleaned_line.append(char)
-                            lines.append(''.join(cleaned_line))
-                        json_str = '\n'.join(lines)
-                        data = json.loads(json_str)
-                        if isinstance(data, list) and len(data) > 0:
-                            return data
-                    except Exception:
-                        # 修复失败，可能是截断了，尝试提取部分数据
-                        if start_idx != -1:
-                            partial_result = _extract_partial_json_array(text[start_idx:])
-                            if partial_result:
-                                return partial_result
-                        pass
-                start_idx = -1
+                    pass
+            # 修复失败，可能是截断了，尝试提取部分数据
+            partial_result = _extract_partial_json_array(text[start_idx:])
+            if partial_result:
+                return partial_result
+            failures += 1
+            if failures >= ARRAY_SEARCH_MAX_FAILURES:
+                break
+            start_idx = text.find('[', start_idx + 1)
+            continue
+        if isinstance(data, list) and len(data) > 0:
+            return data
+        start_idx = text.find('[', end_idx)
     
     # 如果所有方法都失败，尝试从第一个[开始提取部分数据（处理截断情况）
     first_bracket = text.find('[')
@@ -137,12 +185,11 @@ def extract_json_from_text(text: str) -> Optional[List[Dict]]:
     # 方法3: 尝试提取所有JSON对象并组合成数组
     try:
         # 查找所有独立的JSON对象
-        object_pattern = r'\{\s*"[^"]*"\s*:[\s\S]*?\}'
-        matches = re.finditer(object_pattern, text, re.DOTALL)
+        matches = _OBJECT_RE.finditer(text)
         objects = []
         for match in matches:
             try:
-                obj = json.loads(match.group(0))
+                obj = _loads(match.group(0))
                 if isinstance(obj, dict) and 'system' in obj:
                     objects.append(obj)
             except:
@@ -177,55 +224,24 @@ def _extract_partial_json_array(text: str) -> Optional[List[Dict]]:
         return None
     
     # 从第一个[开始，尝试提取完整的JSON对象
-    # 策略：找到每个完整的{...}对象，即使数组没有闭合
+    # 策略：由解码器（C实现）从每个"{"开始解析完整的对象，即使数组没有闭合；
+    # 解析成功后直接跳到该对象之后，失败（通常是被截断的最后一条）则跳过这个"{"继续查找
     objects = []
-    brace_count = 0
-    obj_start = -1
-    in_string = False
-    escape_next = False
-    
-    i = start_idx + 1  # 跳过第一个[
-    while i < len(text):
-        char = text[i]
-        
-        if escape_next:
-            escape_next = False
-            i += 1
-            continue
-        
-        if char == '\\':
-            escape_next = True
-            i += 1
-            continue
-        
-        if char == '"' and not escape_next:
-            in_string = not in_string
-            i += 1
-            continue
-        
-        if in_string:
-            i += 1
+    failures = 0
+    i = text.find('{', start_idx + 1)
+    while i != -1:
+        try:
+            obj, end_idx = _JSON_DECODER.raw_decode(text, i)
+        except json.JSONDecodeError:
+            # 对象解析失败，跳过；失败次数过多说明剩余内容已无完整数据
+            failures += 1
+            if failures >= PARTIAL_EXTRACT_MAX_FAILURES:
+                break
+            i = text.find('{', i + 1)
             continue
-        
-        if char == '{':
-            if brace_count == 0:
-                obj_start = i
-            brace_count += 1
-        elif char == '}':
-            brace_count -= 1
-            if brace_count == 0 and obj_start != -1:
-                # 找到一个完整的对象
-                obj_str = text[obj_start:i+1]
-                try:
-                    obj = json.loads(obj_str)
-                    if isinstance(obj, dict) and 'system' in obj:
-                        objects.append(obj)
-                except json.JSONDecodeError:
-                    # 对象解析失败，跳过
-                    pass
-                obj_start = -1
-        
-        i += 1
+        if isinstance(obj, dict) and 'system' in obj:
+            objects.append(obj)
+        i = text.find('{', end_idx)
     
     if len(objects) > 0:
         print(f"⚠️  检测到JSON可能被截断，已提取 {len(objects)} 条完整数据")
@@ -234,40 +250,163 @@ def _extract_partial_json_array(text: str) -> Optional[List[Dict]]:
     return None
 
 
+def _count_file(file_path: Path) -> Path:
+    """数据文件对应的条数记录文件，例如 1_round.json -> 1_round.count"""
+    return file_path.with_suffix(COUNT_FILE_SUFFIX)
+
+
+def _read_count_file(file_path: Path, st: os.stat_result) -> Optional[int]:
+    """读取条数记录文件，记录的修改时间和大小与数据文件一致时返回条数，否则返回None"""
+    try:
+        mtime_ns, size, count = (int(x) for x in _count_file(file_path).read_text().split())
+    except (OSError, ValueError):
+        return None
+    if mtime_ns != st.st_mtime_ns or size != st.st_size:
+        return None
+    return count
+
+
+def _remember_count(file_path: Path, st: os.stat_result, count: int) -> None:
+    """按给定的修改时间和大小记录数据条数（内存缓存和 .count 文件）"""
+    _COUNT_CACHE[str(file_path)] = (st.st_mtime_ns, st.st_size, count)
+    # 先写临时文件再替换，中断时不会留下不完整的记录
+    count_file = _count_file(file_path)
+    tmp_file = count_file.with_name(count_file.name + '.tmp')
+    try:
+        tmp_file.write_text(f"{st.st_mtime_ns} {st.st_size} {count}\n")
+        os.replace(tmp_file, count_file)
+    except OSError:
+        # 记录文件只是缓存，写入失败时下次重新解析数据文件即可
+        pass
+
+
+def _cache_count(file_path: Path, count: int) -> None:
+    """按文件当前的修改时间和大小记录数据条数（写入数据文件后调用）"""
+    _remember_count(file_path, file_path.stat(), count)
+
+
+def _json_array_length(file_path: Path) -> Optional[int]:
+    """返回文件中JSON数组的长度，文件内容不是有效的JSON数组时返回None
+    
+    只缓存有效数组的长度，文件的修改时间和大小都没变时直接返回缓存值
+    （先查内存缓存，再查 .count 文件），都没有命中时才解析整个文件，
+    并把结果写入 .count 文件，之前的运行留下的文件下次启动时也无需重新解析。
+    """
+    st = file_path.stat()
+    cached = _COUNT_CACHE.get(str(file_path))
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    
+    count = _read_count_file(file_path, st)
+    if count is not None:
+        _COUNT_CACHE[str(file_path)] = (st.st_mtime_ns, st.st_size, count)
+        return count
+    
+    try:
+        data = _loads(file_path.read_bytes())
+    except ValueError:
+        return None
+    if not isinstance(data, list):
+        return None
+    
+    # 记录解析前的修改时间和大小：解析期间文件被修改时，记录会在下次校验时失效
+    _remember_count(file_path, st, len(data))
+    return len(data)
+
+
 def count_data_items(file_path: Path) -> int:
-    """统计JSON文件中的数据条数（通过system字段数量）"""
+    """统计JSON文件中的数据条数（JSON数组的长度）
+    
+    结果按文件的修改时间和大小缓存（同时记录在数据文件旁的 .count 文件中），文件未变化时不再重复读取；
+    文件不是有效的JSON数组时（例如写入中断），退回统计 "system" 字段出现的次数。
+    """
     if not file_path.exists():
         return 0
     
     try:
-        content = file_path.read_text(encoding='utf-8')
-        # 统计 "system" 字段出现的次数
-        count = len(re.findall(r'"system"\s*:', content))
+        count = _json_array_length(file_path)
+        if count is None:
+            count = len(_SYSTEM_KEY_RE.findall(file_path.read_bytes()))
         return count
     except Exception as e:
         print(f"⚠️  读取文件失败 {file_path}: {e}")
         return 0
 
 
-def save_json_data(file_path: Path, new_data: List[Dict]):
-    """保存JSON数据到文件（追加或创建）"""
+def _dumps_array_items(items: List[Dict]) -> bytes:
+    """将多条数据序列化为紧凑的JSON数组元素（每条一行，以 ",\n" 分隔，不含首尾括号）
+    
+    数据文件只供程序读取，不再缩进，文件大小和之后的读取、解析开销约减少一半；
+    每条数据单独一行，仍然便于按行查看和比较。
+    """
+    if orjson is not None:
+        return b",\n".join(orjson.dumps(item, option=orjson.OPT_NON_STR_KEYS) for item in items)
+    return ",\n".join(
+        json.dumps(item, ensure_ascii=False, separators=(',', ':')) for item in items
+    ).encode('utf-8')
+
+
+def _append_to_json_array(file_path: Path, new_data: List[Dict]) -> bool:
+    """把新数据直接拼接到已有JSON数组文件末尾的 "]" 之前，不读取和解析已有内容
+    
+    Returns:
+        True 表示追加成功；文件末尾不是预期的数组结尾时返回False，且不修改文件
+    """
+    with open(file_path, 'r+b') as f:
+        end = f.seek(0, os.SEEK_END)
+        tail_start = max(0, end - 64)
+        f.seek(tail_start)
+        tail = f.read()
+        
+        # 末尾必须是 "]"，且 "]" 之前还有元素（空数组交给整体写入处理）
+        stripped = tail.rstrip()
+        if not stripped.endswith(b']'):
+            return False
+        last_item_end = stripped[:-1].rstrip()
+        if not last_item_end or last_item_end.endswith(b'['):
+            return False
+        
+        # 从最后一个元素之后截断，写入新元素和数组结尾
+        f.seek(tail_start + len(last_item_end))
+        f.truncate()
+        f.write(b",\n" + _dumps_array_items(new_data) + b"\n]")
+    return True
+
+
+def save_json_data(file_path: Path, new_data: List[Dict]) -> int:
+    """保存JSON数据到文件（追加或创建）
+    
+    已有数据的文件直接在数组末尾追加新数据，不重新读取和写出已有内容；
+    文件不存在、为空数组或内容无效时整体写入新数据。
+    
+    Returns:
+        保存后文件中的数据总条数
+    """
     file_path.parent.mkdir(parents=True, exist_ok=True)
     
-    existing_data = []
+    existing_count = None
     if file_path.exists():
         try:
-            content = file_path.read_text(encoding='utf-8')
-            existing_data = json.loads(content)
-            if not isinstance(existing_data, list):
-                existing_data = []
-        except:
-            existing_data = []
+            existing_count = _json_array_length(file_path)
+        except Exception:
+            existing_count = None
     
-    # 合并数据
-    all_data = existing_data + new_data
+    if existing_count is not None and not new_data:
+        # 没有新数据，已有文件保持不变
+        total_count = existing_count
+    elif existing_count and _append_to_json_array(file_path, new_data):
+        total_count = existing_count + len(new_data)
+    else:
+        # 无法直接追加时合并后整体写入（无效的已有内容会被覆盖）
+        all_data = new_data
+        if existing_count:
+            all_data = _loads(file_path.read_bytes()) + new_data
+        with open(file_path, 'wb') as f:
+            f.write(b"[\n" + _dumps_array_items(all_data) + b"\n]" if all_data else b"[]")
+        total_count = len(all_data)
     
-    # 保存
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(all_data, f, ensure_ascii=False, indent=2)
+    # 刚写入的条数已知，直接更新缓存，之后统计时无需重新读取
+    _cache_count(file_path, total_count)
     
-    print(f"✅ 已保存 {len(new_data)} 条新数据到 {file_path} (总计: {len(all_data)} 条)")
+    print(f"✅ 已保存 {len(new_data)} 条新数据到 {file_path} (总计: {total_count} 条)")
+    return total_count